@@ -0,0 +1,57 @@
+#version 330 core
+
+// Ray-cast sphere impostor, shaded like phong_fragment.glsl and writing the sphere's true depth
+
+layout (std140) uniform CameraBlock
+{
+    mat4 view;
+    mat4 projection;
+    vec4 cameraPosition;
+};
+
+uniform vec2 viewportSize;
+
+flat in vec3 sphereCenter;
+flat in float sphereRadius;
+
+out vec4 color;
+
+void main()
+{
+    // View ray through this pixel, from the eye at the origin
+    vec2 ndc = gl_FragCoord.xy / viewportSize * 2.0 - 1.0;
+    vec3 ray = vec3(ndc.x / projection[0][0], ndc.y / projection[1][1], -1.0);
+
+    float a = dot(ray, ray);
+    float b = dot(ray, sphereCenter);
+    float c = dot(sphereCenter, sphereCenter) - sphereRadius * sphereRadius;
+    float discriminant = b * b - a * c;
+    if (discriminant < 0.0)
+        discard;
+
+    vec3 hit = ray * ((b - sqrt(discriminant)) / a);
+    vec4 clip = projection * vec4(hit, 1.0);
+    gl_FragDepth = 0.5 * (gl_DepthRange.diff * clip.z / clip.w + gl_DepthRange.near + gl_DepthRange.far);
+
+    // World space position and normal, view is a rigid transform
+    mat3 viewToWorld = transpose(mat3(view));
+    vec3 norm = viewToWorld * ((hit - sphereCenter) / sphereRadius);
+    vec3 fragmentPos = viewToWorld * (hit - view[3].xyz);
+
+    vec3 lightColor = vec3(1.0, 1.0, 1.0);
+    vec3 lightPos = vec3(10.0, 10.0, 10.0);
+    vec3 objectColor = vec3(0.6, 0.3, 0.7);
+
+    // ambient
+    float ambientStrength = 0.3;
+    vec3 ambient = ambientStrength * lightColor;
+
+    // diffuse
+    vec3 lightDir = normalize(lightPos - fragmentPos);
+    float diff = max(dot(norm, lightDir), 0.0);
+    vec3 diffuse = diff * lightColor;
+
+    vec3 result = (ambient + diffuse) * objectColor;
+
+    color = vec4(result, 1.0);
+}
@@ -0,0 +1,49 @@
+#version 330 core
+
+// One point per sphere, sized and placed to cover the sphere's projected screen-space bounds
+layout (location = 0) in vec4 sphere; // xyz = center, w = radius
+
+layout (std140) uniform CameraBlock
+{
+    mat4 view;
+    mat4 projection;
+    vec4 cameraPosition;
+};
+
+uniform vec2 viewportSize;
+
+flat out vec3 sphereCenter; // view space
+flat out float sphereRadius;
+
+// NDC extent along one axis of a sphere at (c, -depth) seen from the origin, from the two tangent
+// lines through the eye
+vec2 projectedExtent(float c, float depth, float r, float scale)
+{
+    float t = sqrt(max(c * c + depth * depth - r * r, 0.0));
+    float low = (c * t - r * depth) / (depth * t + c * r);
+    float high = (c * t + r * depth) / (depth * t - c * r);
+    return vec2(low, high) * scale;
+}
+
+void main()
+{
+    sphereCenter = (view * vec4(sphere.xyz, 1.0)).xyz;
+    sphereRadius = sphere.w;
+
+    float depth = -sphereCenter.z;
+    if (depth - sphereRadius < 0.1)
+    {
+        // Crosses the near plane, drop it rather than cover the whole screen
+        gl_Position = vec4(2.0, 2.0, 2.0, 1.0);
+        gl_PointSize = 1.0;
+        return;
+    }
+
+    // Clipped to the screen, points whose center lands off screen are discarded entirely
+    vec2 x = clamp(projectedExtent(sphereCenter.x, depth, sphereRadius, projection[0][0]), -1.0, 1.0);
+    vec2 y = clamp(projectedExtent(sphereCenter.y, depth, sphereRadius, projection[1][1]), -1.0, 1.0);
+    vec4 front = projection * vec4(sphereCenter + vec3(0.0, 0.0, sphereRadius), 1.0);
+
+    gl_Position = vec4(0.5 * (x.x + x.y), 0.5 * (y.x + y.y), front.z / front.w, 1.0);
+    gl_PointSize = 0.5 * max((x.y - x.x) * viewportSize.x, (y.y - y.x) * viewportSize.y) + 2.0;
+}
@@ -5,8 +5,12 @@ layout (location = 1) in vec3 vertexNormal;
 layout (location = 2) in vec2 vertexTexCoord;
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
+layout (std140) uniform CameraBlock
+{
+    mat4 view;
+    mat4 projection;
+    vec4 cameraPosition;
+};
 uniform float outline;
 
 out vec3 fragmentPos;
@@ -0,0 +1,26 @@
+#version 330 core
+
+layout (location = 0) in vec3 vertexPos;
+layout (location = 1) in vec3 vertexNormal;
+layout (location = 2) in vec2 vertexTexCoord;
+layout (location = 3) in mat4 instanceModel; // locations 3-6, rotation and uniform scale only
+
+layout (std140) uniform CameraBlock
+{
+    mat4 view;
+    mat4 projection;
+    vec4 cameraPosition;
+};
+
+out vec3 fragmentPos;
+out vec3 fragmentVertexNormal;
+out vec2 fragmentTexCoord;
+
+void main()
+{
+    fragmentPos = vec3(instanceModel * vec4(vertexPos, 1.0));
+    fragmentVertexNormal = mat3(instanceModel) * vertexNormal;
+    fragmentTexCoord = vertexTexCoord;
+
+    gl_Position = projection * view * vec4(fragmentPos, 1.0);
+}
@@ -0,0 +1,26 @@
+#version 330 core
+
+layout (location = 0) in vec3 vertexPos;
+layout (location = 1) in vec3 vertexNormal;
+layout (location = 2) in vec2 vertexTexCoord;
+layout (location = 3) in vec4 instanceTransform; // xyz = position, w = uniform scale
+
+layout (std140) uniform CameraBlock
+{
+    mat4 view;
+    mat4 projection;
+    vec4 cameraPosition;
+};
+
+out vec3 fragmentPos;
+out vec3 fragmentVertexNormal;
+out vec2 fragmentTexCoord;
+
+void main()
+{
+    fragmentPos = instanceTransform.xyz + vertexPos * instanceTransform.w;
+    fragmentVertexNormal = vertexNormal;
+    fragmentTexCoord = vertexTexCoord;
+
+    gl_Position = projection * view * vec4(fragmentPos, 1.0);
+}
@@ -1,3 +1,4 @@
+import argparse
 import time
 
 import pygame as pg
@@ -6,69 +7,84 @@ from OpenGL.GL import *
 import numpy as np
 import pyrr
 
-from src.camera import Camera
-from src.graphics_api import draw_mesh, create_icosphere
-from src.model import Model, Texture, Mesh
+from src.camera import Camera, CameraBlock
+from src.graphics_api import draw_mesh, GPUTimer, InstancedMesh, ImpostorSpheres, link_transforms
+from src.model import Model, Mesh
+from src.profiler import profiler
+from src.recording import Playback, Trajectory
+from src.render_state import render_state
+from src.scenes import cloth
 from src.shader import Shader
-from src.verlet import VerletObject, Solver
-
-
-def distance(point1, point2):
-    distance = np.sqrt((point2[0] - point1[0]) ** 2 + (point2[1] - point1[1]) ** 2 + (point2[2] - point1[2]) ** 2)
-    return distance
+from src.simulate import SpawnSchedule, FixedTimestep
+from src.transform import model_matrices
+from src.verlet import Solver
 
 
 class Window:
     WIDTH = 1400
     HEIGHT = 900
 
-    GLOBAL_X = np.array([1, 0, 0], dtype=np.float32)
-    GLOBAL_Y = np.array([0, 1, 0], dtype=np.float32)
-    GLOBAL_Z = np.array([0, 0, 1], dtype=np.float32)
+    def __init__(self, profile=False, trace_path=None, time_scale=0.09, playback=None, cloth_size=0):
 
-    def __init__(self):
-
-        pg.init()
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_MAJOR_VERSION, 3)
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_MINOR_VERSION, 3)
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_PROFILE_MASK, pg.GL_CONTEXT_PROFILE_CORE)
-        pg.display.gl_set_attribute(pg.GL_STENCIL_SIZE, 8)
-        pg.display.set_mode((Window.WIDTH, Window.HEIGHT), pg.OPENGL | pg.DOUBLEBUF)
+        self.create_display()
 
         self.clock = pg.time.Clock()
         self.dt = 17
 
+        self.profiler = profiler
+        self.profiler.enabled = profile or trace_path is not None
+        self.profiler.trace = trace_path is not None
+        self.trace_path = trace_path
+        self.gpu_timer = GPUTimer(self.profiler)
+
         glClearColor(0.08, 0.08, 0.08, 1.0)
         glClearStencil(0)
 
         # Render settings
-        glEnable(GL_DEPTH_TEST)
+        render_state.enable(GL_DEPTH_TEST)
         glDepthFunc(GL_LESS)
 
-        glEnable(GL_CULL_FACE)
+        render_state.enable(GL_CULL_FACE)
         glCullFace(GL_BACK)
         glFrontFace(GL_CCW)
 
-        glEnable(GL_BLEND)
+        render_state.enable(GL_BLEND)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
         glPointSize(2.0)
 
-        # glEnable(GL_STENCIL_TEST)
+        # render_state.enable(GL_STENCIL_TEST)
         # glStencilFunc(GL_NOTEQUAL, 1, 0xFF)
         # glStencilOp(GL_KEEP, GL_KEEP, GL_REPLACE)
 
-        self.font = pg.font.Font("assets/Monocode.ttf", 30)
-
-        self.num_balls = 0
+        self.spawner = SpawnSchedule(max_balls=350)
         self.container = Model("models/sphere.obj", position=(0, 0, 0), scale=4)
         # self.container = Model("models/cube.obj", position=(0, 0, 0), scale=5)
 
         self.solver = Solver(self.container)
+        # Settled balls move little per step, cached kd pairs are rebuilt about every other step
+        self.solver.skin = 1.0
+        # Steps the solver by elapsed real time, independent of the frame rate
+        self.timestep = FixedTimestep(self.solver, self.spawner, time_scale=time_scale)
+        if playback is not None:
+            # Replay a trajectory recorded with src.simulate --record instead of simulating
+            self.timestep = Playback(self.solver, Trajectory(playback), time_scale=time_scale)
+        elif cloth_size:
+            # Net of cloth_size x cloth_size balls centered in the container, corners pinned
+            half = 0.5 * (cloth_size - 1) / 2
+            cloth(self.solver, cloth_size, cloth_size, spacing=0.5, radius=0.15, origin=(-half, 0, -half))
         self.sphere_mesh = Mesh("models/ico_sphere.obj")
         self.cube_mesh = Mesh("models/cube.obj")
         self.cyl_mesh = Mesh("models/cylinder.obj")
 
+        # Draw all balls and all links in one instanced call each (toggle with I)
+        self.instanced = True
+        self.sphere_instances = InstancedMesh(self.sphere_mesh)
+        self.link_instances = InstancedMesh(self.cyl_mesh, instance_size=16)
+        # Or as ray-cast point sprites, one vertex per ball (toggle with O)
+        self.impostors = False
+        self.sphere_impostors = ImpostorSpheres()
+
         self.camera_radius = 12
         self.camera_speed = 8
         self.camera = Camera(position=(0, 3, self.camera_radius))
@@ -78,113 +94,127 @@ class Window:
         self.setup_shader()
         self.run()
 
+    def create_display(self):
+        # Window and GL 3.3 core context, see offscreen.OffscreenWindow for rendering without one
+        pg.init()
+        pg.display.gl_set_attribute(pg.GL_CONTEXT_MAJOR_VERSION, 3)
+        pg.display.gl_set_attribute(pg.GL_CONTEXT_MINOR_VERSION, 3)
+        pg.display.gl_set_attribute(pg.GL_CONTEXT_PROFILE_MASK, pg.GL_CONTEXT_PROFILE_CORE)
+        pg.display.gl_set_attribute(pg.GL_STENCIL_SIZE, 8)
+        pg.display.set_mode((self.WIDTH, self.HEIGHT), pg.OPENGL | pg.DOUBLEBUF)
+
+        self.font = pg.font.Font("assets/Monocode.ttf", 30)
+
     def run(self):
 
-        self.num_frames = 0
         self.global_time = time.time()
 
-        # # Build the net
-        # vs = []
-        # for x in range(-5, 6):
-        #     for y in range(-5, 6):
-        #         tag = 0
-        #         if abs(x) == 5 and abs(y) == 5:
-        #             tag = 1
-        #         v = VerletObject(position=(x / 2, 0, y / 2), radius=0.15, tag=tag)
-        #         vs.append(v)
-        #         self.solver.add_object(v)
-        #
-        # for v in vs:
-        #     distances = [(distance(v.pos_curr, neighbor.pos_curr), neighbor) for neighbor in vs if
-        #                  neighbor != v]
-        #     distances.sort(key=lambda x : x[0])  # Sort by distance (closest to farthest)
-        #     n = 0
-        #     nearest = distances[n][0]
-        #     while distances[n][0] == nearest:
-        #         self.solver.add_link(0.5, v, distances[n][1])
-        #         n += 1
-
         running = True
         while running:
             self.global_time = time.time()
+            frame_start = time.perf_counter()
 
             # Poll events
-            for event in pg.event.get():
-                if event.type == pg.QUIT:
+            with self.profiler.scope("events"):
+                for event in pg.event.get():
+                    if event.type == pg.QUIT:
+                        running = False
+                    if event.type == pg.KEYDOWN and event.key == pg.K_i:
+                        self.instanced = not self.instanced
+                    if event.type == pg.KEYDOWN and event.key == pg.K_o:
+                        self.impostors = not self.impostors
+
+                if pg.key.get_pressed()[pg.K_ESCAPE]:
                     running = False
 
-            if pg.key.get_pressed()[pg.K_ESCAPE]:
-                running = False
-
-            # Lock camera
-            if self.fix_camera:
-                self.animate_camera()
-
-            # Handle input
-            self.handle_keyboard()
-            self.handle_mouse()
-
-            # Refresh screen
-            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT | GL_STENCIL_BUFFER_BIT)
-
-            # Update view matrix
-            self.shader.use()
-            self.camera.update_view(self.viewMatrixLocation)
-            self.shader.detach()
-            self.outline_shader.use()
-            self.camera.update_view(self.viewMatrixLocationOutline)
-            self.outline_shader.detach()
-
-            # Render container
-            draw_mesh(self.outline_shader, self.container.mesh, self.modelMatrixLocationOutline,
-                      self.container.position, scale=self.container.scale, method=GL_POINTS)
+                # Lock camera
+                if self.fix_camera:
+                    self.animate_camera()
 
-            # Add balls to the simulation
-            if self.num_frames >= 1 and self.num_balls < 350:
-                x = np.cos(np.deg2rad(360 * np.random.rand()))
-                y = np.sin(np.deg2rad(360 * np.random.rand()))
-                self.solver.add_object(VerletObject(position=(x * 2, 3, y * 2), radius=0.2))
+                # Handle input
+                self.handle_keyboard()
+                self.handle_mouse()
 
-                self.num_balls += 1
-                self.num_frames = 0
-
-            # Update the positions of all the balls
-            self.solver.update()
-
-            # Render the balls
-            for verlet in self.solver.verlet_objects:
-                draw_mesh(self.shader, self.sphere_mesh, self.modelMatrixLocation, verlet.pos_curr, scale=verlet.radius)
-
-            # Render the links
-            for link in self.solver.links:
-                disp = link.a.pos_curr - link.b.pos_curr
-                dist = np.sqrt(disp.dot(disp))
-                n = disp / dist
-                center = link.b.pos_curr + n * 0.5 * dist
-
-                direction_vector = n / np.linalg.norm(n)
-                up_vector = Window.GLOBAL_Y
-
-                right_vector = np.cross(up_vector, direction_vector)
-                right_vector /= np.linalg.norm(right_vector)
-                new_up_vector = np.cross(right_vector, direction_vector)
-                new_up_vector /= np.linalg.norm(new_up_vector)
-
-                rotation_matrix = np.array([right_vector, new_up_vector, -direction_vector], dtype=np.float32)
-
-                draw_mesh(self.shader, self.cyl_mesh, self.modelMatrixLocation, center,
-                          rotation_matrix=rotation_matrix, scale=0.3)
+            self.render_frame()
 
             # Display the next buffer
-            pg.display.flip()
+            with self.profiler.scope("flip"):
+                pg.display.flip()
+            self.gpu_timer.collect()
 
             # Timing
             self.dt = self.clock.tick(60)
             pg.display.set_caption(f'FPS: {int(self.clock.get_fps())} | Balls: {len(self.solver.verlet_objects)}')
-            self.num_frames += 1
+            if self.profiler.enabled:
+                self.profiler.record("frame", frame_start, time.perf_counter() - frame_start)
 
         self.quit()
 
+    def render_frame(self):
+        # One simulation step and everything drawn into the current framebuffer
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT | GL_STENCIL_BUFFER_BIT)
+
+        # Update view matrix
+        with self.profiler.scope("view_uniforms"):
+            self.camera_block.update(self.camera)
+
+        # Render container
+        with self.profiler.scope("container_draw"), self.gpu_timer.scope("container_draw"):
+            draw_mesh(self.outline_shader, self.container.mesh, self.modelMatrixLocationOutline,
+                      self.container.position, scale=self.container.scale, method=GL_POINTS)
+
+        # Add balls and update their positions for the time the last frame took (self.dt, in ms)
+        with self.profiler.scope("solver.update"):
+            self.timestep.advance(self.dt / 1000)
+
+        # Render the balls
+        with self.profiler.scope("balls_draw"), self.gpu_timer.scope("balls_draw"):
+            self.render_balls()
+
+        # Render the links
+        with self.profiler.scope("links_draw"), self.gpu_timer.scope("links_draw"):
+            self.render_links()
+
+    def render_balls(self):
+        if self.impostors:
+            store = self.solver.store
+            spheres = self.sphere_impostors.staging(store.count)
+            spheres[:, :3] = self.timestep.positions()
+            spheres[:, 3] = store.radius
+            self.sphere_impostors.update(spheres)
+            self.sphere_impostors.draw(self.impostor_shader, (self.WIDTH, self.HEIGHT))
+        elif self.instanced:
+            store = self.solver.store
+            instances = self.sphere_instances.staging(store.count)
+            instances[:, :3] = self.timestep.positions()
+            instances[:, 3] = store.radius
+            self.sphere_instances.update(instances)
+            self.sphere_instances.draw(self.instanced_shader)
+        else:
+            models = model_matrices(self.timestep.positions(), self.solver.store.radius)
+            self.shader.use()
+            render_state.bind_vertex_array(self.sphere_mesh.vao)
+            for model in models:
+                glUniformMatrix4fv(self.modelMatrixLocation, 1, GL_FALSE, model)
+                self.sphere_mesh.draw()
+
+    def render_links(self):
+        link_a, link_b, _ = self.solver.get_link_arrays()
+        positions = self.timestep.positions()
+        if self.instanced:
+            instances = self.link_instances.staging(len(link_a))
+            link_transforms(positions[link_a], positions[link_b], 0.3, instances.reshape(-1, 4, 4))
+            self.link_instances.update(instances)
+            self.link_instances.draw(self.link_shader)
+        else:
+            models = link_transforms(positions[link_a], positions[link_b], 0.3,
+                                     np.empty((len(link_a), 4, 4), dtype=np.float32))
+            self.shader.use()
+            render_state.bind_vertex_array(self.cyl_mesh.vao)
+            for model in models:
+                glUniformMatrix4fv(self.modelMatrixLocation, 1, GL_FALSE, model)
+                self.cyl_mesh.draw()
+
     def handle_keyboard(self):
         keys = pg.key.get_pressed()
 
@@ -229,42 +259,59 @@ class Window:
         self.sphere_mesh.destroy()
         self.cube_mesh.destroy()
         self.cyl_mesh.destroy()
+        if self.profiler.enabled:
+            print("Ball instance stream:", self.sphere_instances.stream.stats())
+            print("Link instance stream:", self.link_instances.stream.stats())
+        self.sphere_instances.destroy()
+        self.link_instances.destroy()
+        self.sphere_impostors.destroy()
         # self.texture.destroy()
         self.shader.destroy()
         self.outline_shader.destroy()
+        self.instanced_shader.destroy()
+        self.link_shader.destroy()
+        self.impostor_shader.destroy()
+        self.camera_block.destroy()
+        self.gpu_timer.destroy()
+        if self.profiler.enabled:
+            print(self.profiler.summary())
+        if self.trace_path is not None:
+            self.profiler.save_trace(self.trace_path)
         pg.quit()
 
     def setup_shader(self):
+        # View, projection and camera position are shared by all programs through the CameraBlock UBO
+        projection = pyrr.matrix44.create_perspective_projection(
+            fovy=45, aspect=self.WIDTH / self.HEIGHT,
+            near=0.1, far=100, dtype=np.float32
+        )
+        self.camera_block = CameraBlock(projection)
+
         self.shader = Shader("shaders/phong_vertex.glsl", "shaders/phong_fragment.glsl")
-        self.shader.use()
+        self.camera_block.bind_program(self.shader.shader_id)
 
         # glUniform1i(glGetUniformLocation(self.shader, "imageTexture"), 0)
         # self.texture = Material("textures/leet.png")
 
-        projection = pyrr.matrix44.create_perspective_projection(
-            fovy=45, aspect=Window.WIDTH / Window.HEIGHT,
-            near=0.1, far=100, dtype=np.float32
-        )
-
-        glUniformMatrix4fv(
-            glGetUniformLocation(self.shader.shader_id, "projection"),
-            1, GL_FALSE, projection
-        )
-        self.modelMatrixLocation = glGetUniformLocation(self.shader.shader_id, "model")
-        self.viewMatrixLocation = glGetUniformLocation(self.shader.shader_id, "view")
-        self.shader.detach()
+        self.modelMatrixLocation = self.shader.location("model")
 
         # Outline shader
         self.outline_shader = Shader("shaders/outline_vertex.glsl", "shaders/outline_fragment.glsl")
-        self.outline_shader.use()
-        glUniformMatrix4fv(
-            glGetUniformLocation(self.outline_shader.shader_id, "projection"),
-            1, GL_FALSE, projection
-        )
-        glUniform1f(glGetUniformLocation(self.outline_shader.shader_id, "outline"), 0.00)
-        self.modelMatrixLocationOutline = glGetUniformLocation(self.outline_shader.shader_id, "model")
-        self.viewMatrixLocationOutline = glGetUniformLocation(self.outline_shader.shader_id, "view")
-        self.outline_shader.detach()
+        self.camera_block.bind_program(self.outline_shader.shader_id)
+        self.outline_shader.set_uniform("outline", 0.00)
+        self.modelMatrixLocationOutline = self.outline_shader.location("model")
+
+        # Instanced ball shader
+        self.instanced_shader = Shader("shaders/phong_instanced_vertex.glsl", "shaders/phong_fragment.glsl")
+        self.camera_block.bind_program(self.instanced_shader.shader_id)
+
+        # Instanced link shader
+        self.link_shader = Shader("shaders/phong_instanced_matrix_vertex.glsl", "shaders/phong_fragment.glsl")
+        self.camera_block.bind_program(self.link_shader.shader_id)
+
+        # Ray-cast ball impostors
+        self.impostor_shader = Shader("shaders/impostor_vertex.glsl", "shaders/impostor_fragment.glsl")
+        self.camera_block.bind_program(self.impostor_shader.shader_id)
 
     def animate_camera(self):
         keys = pg.key.get_pressed()
@@ -274,7 +321,9 @@ class Window:
         if keys[pg.K_s]:
             self.camera_radius += 0.08
             self.camera.pitch += 0.4
+        self.orbit_camera()
 
+    def orbit_camera(self):
         x = np.cos(np.deg2rad(self.global_time * self.camera_speed))
         z = np.sin(np.deg2rad(self.global_time * self.camera_speed))
         self.camera.position[0] = x * self.camera_radius
@@ -289,4 +338,15 @@ class Window:
 
 
 if __name__ == '__main__':
-    Window()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", action="store_true", help="print per-phase frame timings on exit")
+    parser.add_argument("--trace", help="write a Chrome trace JSON to this path on exit")
+    parser.add_argument("--time-scale", type=float, default=0.09, help="simulated seconds per real second")
+    parser.add_argument("--sub-steps", type=int, default=Solver.sub_steps, help="solver sub-steps per step")
+    parser.add_argument("--play", metavar="PATH", help="replay a trajectory recorded with src.simulate --record")
+    parser.add_argument("--cloth", type=int, default=0,
+                        help="hang an N x N cloth pinned at its corners in the container")
+    args = parser.parse_args()
+    Solver.sub_steps = args.sub_steps
+    Window(profile=args.profile, trace_path=args.trace, time_scale=args.time_scale, playback=args.play,
+           cloth_size=args.cloth)
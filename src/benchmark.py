@@ -0,0 +1,164 @@
+import argparse
+import csv
+import json
+import platform
+import subprocess
+import time
+
+import numpy as np
+from scipy.spatial import KDTree
+
+from src.verlet import Container, Solver
+
+COLLISION_PHASES = ("kd_collisions", "neighbor_collisions", "grid_collisions", "brute_collisions")
+PHASES = ("apply_forces",) + COLLISION_PHASES + ("apply_constraints", "update_positions", "update_links", "update")
+FIELDS = ("count", "links", "phase", "median", "mean", "min", "repeats")
+
+
+def build_scene(count, links, radius=0.2, packing=0.3, seed=0, backend="numpy"):
+    # Container sized so the balls fill `packing` of its volume, balls scattered uniformly inside it
+    rng = np.random.default_rng(seed)
+    scale = radius * (count / packing) ** (1 / 3) + radius
+    solver = Solver(Container(scale=scale), backend=backend)
+
+    directions = rng.normal(size=(count, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    distances = (scale - radius) * rng.random(count) ** (1 / 3)
+    solver.add_objects(directions * distances[:, None], radius)
+
+    if links:
+        # Link every ball to its nearest neighbor, mutual nearest neighbors are linked once
+        _, nearest = KDTree(solver.store.pos_curr).query(solver.store.pos_curr, k=2)
+        solver.links.add_many(np.arange(count), nearest[:, 1], 2 * radius)
+    return solver
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def benchmark_scene(solver, repeats, brute_max):
+    samples = {phase: [] for phase in PHASES}
+    sub_dt = Solver.time_step / Solver.sub_steps
+    store = solver.store
+    for _ in range(repeats):
+        samples["apply_forces"].append(time_call(solver.apply_forces))
+
+        # Every broadphase starts from the same positions, the kd result is kept
+        start = store.pos_curr.copy()
+        for phase in COLLISION_PHASES:
+            if phase == "brute_collisions" and store.count > brute_max:
+                continue
+            store.pos_curr[:] = start
+            samples[phase].append(time_call(getattr(solver, phase)))
+        if samples["kd_collisions"]:
+            store.pos_curr[:] = start
+            solver.kd_collisions()
+
+        samples["apply_constraints"].append(time_call(solver.apply_constraints))
+        samples["update_positions"].append(time_call(solver.update_positions, sub_dt))
+        samples["update_links"].append(time_call(solver.update_links))
+        samples["update"].append(time_call(solver.update))
+    return samples
+
+
+def run(counts, repeats=5, warmup=2, brute_max=500, seed=0, backend="numpy"):
+    rows = []
+    for count in counts:
+        for links in (False, True):
+            solver = build_scene(count, links, seed=seed, backend=backend)
+            for _ in range(warmup):
+                solver.update()
+            samples = benchmark_scene(solver, repeats, brute_max)
+            for phase in PHASES:
+                times = samples[phase]
+                if not times:
+                    continue
+                rows.append({
+                    "count": count,
+                    "links": len(solver.links),
+                    "phase": phase,
+                    "median": float(np.median(times)),
+                    "mean": float(np.mean(times)),
+                    "min": float(np.min(times)),
+                    "repeats": len(times),
+                })
+                print(f"{count:>7} balls | {len(solver.links):>7} links | {phase:<18} "
+                      f"{rows[-1]['median'] * 1000:10.3f} ms")
+    return rows
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(path, rows, meta):
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, "w") as f:
+            json.dump({"meta": meta, "results": rows}, f, indent=2)
+
+
+def load(path):
+    if path.endswith(".csv"):
+        with open(path, newline="") as f:
+            return [{**row, "count": int(row["count"]), "links": int(row["links"]), "median": float(row["median"])}
+                    for row in csv.DictReader(f)]
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def compare(baseline, rows):
+    # Ratio > 1 means the current run is slower than the baseline
+    reference = {(row["count"], row["links"] > 0, row["phase"]): row["median"] for row in baseline}
+    for row in rows:
+        key = (row["count"], row["links"] > 0, row["phase"])
+        if key in reference and reference[key] > 0:
+            print(f"{row['count']:>7} balls | links: {str(key[1]):<5} | {row['phase']:<18} "
+                  f"{row['median'] / reference[key]:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the Solver passes over a range of ball counts")
+    parser.add_argument("--counts", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--brute-max", type=int, default=500, help="skip brute_collisions above this count")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=("numpy", "numba"), default=Solver.backend)
+    parser.add_argument("--skin", type=float, default=Solver.skin, help="neighbor list skin in max radii")
+    parser.add_argument("--output", default="benchmark.json", help=".json or .csv")
+    parser.add_argument("--compare", help="earlier .json/.csv result to compare against")
+    args = parser.parse_args()
+    Solver.skin = args.skin
+
+    rows = run(args.counts, args.repeats, args.warmup, args.brute_max, args.seed, args.backend)
+    meta = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "backend": args.backend,
+        "time_step": Solver.time_step,
+        "sub_steps": Solver.sub_steps,
+        "skin": Solver.skin,
+    }
+    save(args.output, rows, meta)
+    if args.compare:
+        compare(load(args.compare), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,9 +7,49 @@ class Camera:
 
     def __init__(self, position=(0, 0, 0)):
         self.position = np.array(position, dtype=np.float64)
-        self.yaw = -90
-        self.pitch = 0
+        self._yaw = -90
+        self._pitch = 0
+        self.dirty = True
+        self.cached_position = None
+        self.view = None
+        self.version = 0  # Bumped every time the view matrix changes
+        self.update()
+
+    # Changing yaw or pitch marks the camera dirty. position is edited in place by callers, so it is
+    # compared against the copy taken at the last update instead.
+    @property
+    def yaw(self):
+        return self._yaw
+
+    @yaw.setter
+    def yaw(self, value):
+        self._yaw = value
+        self.dirty = True
+
+    @property
+    def pitch(self):
+        return self._pitch
+
+    @pitch.setter
+    def pitch(self, value):
+        self._pitch = value
+        self.dirty = True
+
+    def update(self):
+        # Recompute the vectors and view matrix if anything moved, returns whether it did
+        if not self.dirty and np.array_equal(self.position, self.cached_position):
+            return False
         self.update_vectors()
+        self.view = pyrr.matrix44.create_look_at(
+            eye=self.position,
+            target=self.position + self.forwards,
+            up=self.up,
+            dtype=np.float32
+        )
+        self.cached_position = self.position.copy()
+        self.dirty = False
+        self.version += 1
+        return True
 
     def update_vectors(self):
         self.forwards = np.array(
@@ -29,12 +69,49 @@ class Camera:
         self.up = np.cross(self.right, self.forwards)
         self.up = self.up / np.linalg.norm(self.up)
 
-    def update_view(self, viewMatrixLocation):
-        self.update_vectors()
-        view = pyrr.matrix44.create_look_at(
-            eye=self.position,
-            target=self.position + self.forwards,
-            up=self.up,
-            dtype=np.float32
-        )
-        glUniformMatrix4fv(viewMatrixLocation, 1, GL_FALSE, view)
+
+# std140 uniform block shared by every program that declares CameraBlock:
+#   mat4 view (offset 0), mat4 projection (offset 64), vec4 cameraPosition (offset 128)
+class CameraBlock:
+    BINDING = 0
+    NAME = "CameraBlock"
+
+    def __init__(self, projection):
+        self.data = np.zeros(36, dtype=np.float32)
+        self.data[16:32] = np.asarray(projection, dtype=np.float32).ravel()
+        self.camera_version = None
+
+        self.ubo = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, self.data, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        glBindBufferBase(GL_UNIFORM_BUFFER, CameraBlock.BINDING, self.ubo)
+
+    def bind_program(self, program):
+        index = glGetUniformBlockIndex(program, CameraBlock.NAME)
+        if index != GL_INVALID_INDEX:
+            glUniformBlockBinding(program, index, CameraBlock.BINDING)
+
+    def set_projection(self, projection):
+        self.data[16:32] = np.asarray(projection, dtype=np.float32).ravel()
+        self.upload()
+
+    def update(self, camera):
+        # Uploads only when the camera changed since the last call
+        camera.update()
+        if camera.version == self.camera_version:
+            return False
+        self.camera_version = camera.version
+        self.data[0:16] = camera.view.ravel()
+        self.data[32:35] = camera.position
+        self.data[35] = 1
+        self.upload()
+        return True
+
+    def upload(self):
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def destroy(self):
+        glDeleteBuffers(1, (self.ubo,))
@@ -1,46 +1,340 @@
+import ctypes
+import time
+from collections import Counter, deque
+
 import numpy as np
-import pyrr
 from OpenGL.GL import *
+from OpenGL.error import GLError, NullFunctionError
+
+from src.profiler import NULL_SCOPE
+from src.render_state import render_state
+from src.transform import euler_matrices, trs_matrix
 
 
 def draw_mesh(shader, mesh, model_location, position, rotation=(0, 0, 0), rotation_matrix=None, scale=1,
               method=GL_TRIANGLES):
-    position = np.array(position, dtype=np.float32)
-    rotation = np.array(rotation, dtype=np.float32)
-    scale = np.array([scale] * 3, dtype=np.float32)
-    model = pyrr.matrix44.create_identity(dtype=np.float32)
-    model = pyrr.matrix44.multiply(
-        m1=model,
-        m2=pyrr.matrix44.create_from_scale(scale)
-    )
-
-    if rotation_matrix is None:
-        model = pyrr.matrix44.multiply(
-            m1=model,
-            m2=pyrr.matrix44.create_from_eulers(
-                eulers=rotation,
-                dtype=np.float32
-            )
-        )
-    else:
-        model = pyrr.matrix44.multiply(
-            m1=model,
-            m2=pyrr.matrix44.create_from_matrix33(rotation_matrix)
-        )
-
-    model = pyrr.matrix44.multiply(
-        m1=model,
-        m2=pyrr.matrix44.create_from_translation(
-            vec=position,
-            dtype=np.float32
-        )
-    )
+    if rotation_matrix is None and any(rotation):
+        rotation_matrix = euler_matrices(rotation)
+    model = trs_matrix(position, rotation_matrix, scale)
     shader.use()
     glUniformMatrix4fv(model_location, 1, GL_FALSE, model)
-    glBindVertexArray(mesh.vao)
-    glDrawArrays(method, 0, mesh.vertex_count)
-    shader.detach()
-    glBindVertexArray(0)
+    render_state.bind_vertex_array(mesh.vao)
+    mesh.draw(method)
+
+
+# Ring of `segments` buffers for data that is rewritten every frame. Each upload goes to the next
+# buffer in the ring, so the GPU can still be reading the previous frames' data while the CPU writes.
+# In "map" mode the buffer is written through glMapBufferRange with GL_MAP_UNSYNCHRONIZED_BIT, which
+# is only safe once the fence placed after its last draw (see fence()) has signaled; a buffer whose
+# fence has not signaled yet is orphaned instead of waited on. "orphan" mode always respecifies the
+# storage with glBufferData(NULL) before glBufferSubData. Buffers grow geometrically and never shrink.
+class StreamBuffer:
+
+    def __init__(self, segments=3, mode="map", target=GL_ARRAY_BUFFER, usage=GL_STREAM_DRAW):
+        if mode not in ("map", "orphan"):
+            raise ValueError(f"Unknown stream buffer mode: {mode}")
+        self.mode = mode
+        self.target = target
+        self.usage = usage
+        self.buffers = [int(buffer) for buffer in np.atleast_1d(glGenBuffers(segments))]
+        self.sizes = [0] * segments
+        self.fences = [None] * segments
+        self.index = -1
+        self.counters = Counter()
+
+    @property
+    def buffer(self):
+        # Buffer written by the last upload
+        return self.buffers[self.index]
+
+    @property
+    def capacity(self):
+        return min(self.sizes)
+
+    def upload(self, data):
+        # data: array or any other buffer protocol object, read in place when it is C-contiguous.
+        # Returns the buffer it now lives in, which changes every call.
+        data = np.ascontiguousarray(data)
+        nbytes = data.nbytes
+        self.index = (self.index + 1) % len(self.buffers)
+        glBindBuffer(self.target, self.buffers[self.index])
+        self.counters["uploads"] += 1
+        self.counters["bytes"] += nbytes
+
+        size = self.sizes[self.index]
+        if nbytes > size:
+            size = max(nbytes, 2 * size, 1024)
+            glBufferData(self.target, size, None, self.usage)
+            self.sizes[self.index] = size
+            self.counters["grows"] += 1
+            self.retire_fence()
+            orphaned = True
+        elif self.mode == "orphan":
+            glBufferData(self.target, size, None, self.usage)
+            self.counters["orphans"] += 1
+            orphaned = True
+        elif not self.fence_signaled():
+            # The GPU may still be reading this segment, a synchronized map would wait for it
+            glBufferData(self.target, size, None, self.usage)
+            self.counters["orphans"] += 1
+            self.counters["stalls_avoided"] += 1
+            orphaned = True
+        else:
+            orphaned = False
+
+        if nbytes:
+            if self.mode == "map":
+                flags = GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_RANGE_BIT
+                if not orphaned:
+                    flags |= GL_MAP_UNSYNCHRONIZED_BIT
+                    self.counters["unsynchronized"] += 1
+                pointer = glMapBufferRange(self.target, 0, nbytes, flags)
+                ctypes.memmove(pointer, data.ctypes.data, nbytes)
+                glUnmapBuffer(self.target)
+            else:
+                glBufferSubData(self.target, 0, nbytes, data)
+        glBindBuffer(self.target, 0)
+        return self.buffers[self.index]
+
+    def fence(self):
+        # Call after the draws that read the last upload, so its buffer can be rewritten unsynchronized
+        if self.mode == "map" and self.index >= 0:
+            self.retire_fence()
+            self.fences[self.index] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+    def fence_signaled(self):
+        fence = self.fences[self.index]
+        if fence is None:
+            return True
+        if glClientWaitSync(fence, 0, 0) in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+            self.retire_fence()
+            return True
+        return False
+
+    def retire_fence(self):
+        fence = self.fences[self.index]
+        if fence is not None:
+            glDeleteSync(fence)
+            self.fences[self.index] = None
+
+    def stats(self):
+        return {**self.counters, "capacity": self.capacity, "segments": len(self.buffers), "mode": self.mode}
+
+    def destroy(self):
+        for fence in self.fences:
+            if fence is not None:
+                glDeleteSync(fence)
+        self.fences = [None] * len(self.buffers)
+        glDeleteBuffers(len(self.buffers), self.buffers)
+
+
+# Second VAO over a Mesh's vertex and index buffers plus a per-instance stream, so every instance
+# is drawn in one call. Each instance is `instance_size` floats, bound as consecutive vec4 attributes
+# from location 3 with divisor 1 (4 floats -> one vec4, 16 floats -> a mat4).
+class InstancedMesh:
+
+    def __init__(self, mesh, instance_size=4):
+        self.mesh = mesh
+        self.instance_size = instance_size
+        self.instance_count = 0
+        self.staging_data = np.empty((0, instance_size), dtype=np.float32)
+        self.stream = StreamBuffer()
+        self.bound_buffer = None
+
+        self.vao = glGenVertexArrays(1)
+        render_state.bind_vertex_array(self.vao)
+        mesh.bind_attributes()
+        for column in range(instance_size // 4):
+            glEnableVertexAttribArray(3 + column)
+            glVertexAttribDivisor(3 + column, 1)
+
+    def bind_instance_buffer(self, buffer):
+        # Attribute pointers capture the buffer bound when they are set, so they follow the ring
+        render_state.bind_vertex_array(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, buffer)
+        stride = self.instance_size * 4
+        for column in range(self.instance_size // 4):
+            glVertexAttribPointer(3 + column, 4, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(column * 16))
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.bound_buffer = buffer
+
+    def staging(self, count):
+        # (count, instance_size) float32 scratch rows to fill before update, reused between frames
+        if count > len(self.staging_data):
+            self.staging_data = np.empty((max(count, 2 * len(self.staging_data)), self.instance_size),
+                                         dtype=np.float32)
+        return self.staging_data[:count]
+
+    def update(self, data):
+        # data: (N, instance_size) float32, C-contiguous
+        self.instance_count = len(data)
+        if not self.instance_count:
+            return
+        buffer = self.stream.upload(data)
+        if buffer != self.bound_buffer:
+            self.bind_instance_buffer(buffer)
+
+    def draw(self, shader, method=GL_TRIANGLES):
+        if not self.instance_count:
+            return
+        shader.use()
+        render_state.bind_vertex_array(self.vao)
+        self.mesh.draw_instanced(self.instance_count, method)
+        self.stream.fence()
+
+    def destroy(self):
+        render_state.forget_vertex_array(self.vao)
+        glDeleteVertexArrays(1, (self.vao,))
+        self.stream.destroy()
+
+
+# Spheres drawn as one GL_POINTS vertex each and ray-cast in the fragment shader
+# (shaders/impostor_*.glsl), so vertex work no longer scales with the sphere mesh. Each sphere is a
+# vec4 of center and radius at location 0. Points are limited to GL_POINT_SIZE_RANGE, spheres
+# covering more pixels than that are clipped.
+class ImpostorSpheres:
+
+    def __init__(self):
+        self.count = 0
+        self.staging_data = np.empty((0, 4), dtype=np.float32)
+        self.stream = StreamBuffer()
+        self.bound_buffer = None
+
+        self.vao = glGenVertexArrays(1)
+        render_state.bind_vertex_array(self.vao)
+        glEnableVertexAttribArray(0)
+
+    def staging(self, count):
+        # (count, 4) float32 scratch rows to fill before update, reused between frames
+        if count > len(self.staging_data):
+            self.staging_data = np.empty((max(count, 2 * len(self.staging_data)), 4), dtype=np.float32)
+        return self.staging_data[:count]
+
+    def update(self, data):
+        # data: (N, 4) float32 center and radius, C-contiguous
+        self.count = len(data)
+        if not self.count:
+            return
+        buffer = self.stream.upload(data)
+        if buffer != self.bound_buffer:
+            render_state.bind_vertex_array(self.vao)
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glVertexAttribPointer(0, 4, GL_FLOAT, GL_FALSE, 16, ctypes.c_void_p(0))
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            self.bound_buffer = buffer
+
+    def draw(self, shader, viewport_size):
+        if not self.count:
+            return
+        shader.set_uniform("viewportSize", viewport_size)
+        shader.use()
+        render_state.bind_vertex_array(self.vao)
+        # The shader sizes the points, other GL_POINTS draws keep using glPointSize
+        render_state.enable(GL_PROGRAM_POINT_SIZE)
+        glDrawArrays(GL_POINTS, 0, self.count)
+        render_state.disable(GL_PROGRAM_POINT_SIZE)
+        self.stream.fence()
+
+    def destroy(self):
+        render_state.forget_vertex_array(self.vao)
+        glDeleteVertexArrays(1, (self.vao,))
+        self.stream.destroy()
+
+
+def link_transforms(pos_a, pos_b, scale, out):
+    # Model matrices (pyrr layout, (L, 4, 4) float32) placing a unit cylinder between each pair of
+    # endpoints: local -Z along a - b, centered on the midpoint
+    disp = pos_a - pos_b
+    dist = np.sqrt(np.einsum('ij,ij->i', disp, disp))
+    direction = np.tile(np.array([0.0, 0.0, 1.0]), (len(disp), 1))
+    nonzero = dist > 0
+    direction[nonzero] = disp[nonzero] / dist[nonzero, None]
+
+    right = np.cross(np.array([0.0, 1.0, 0.0]), direction)
+    right_len = np.sqrt(np.einsum('ij,ij->i', right, right))
+    # Links parallel to the global up axis take their frame from the global X axis instead
+    parallel = right_len < 1e-6
+    right[parallel] = np.cross(np.array([1.0, 0.0, 0.0]), direction[parallel])
+    right /= np.sqrt(np.einsum('ij,ij->i', right, right))[:, None]
+    up = np.cross(right, direction)
+    up /= np.sqrt(np.einsum('ij,ij->i', up, up))[:, None]
+
+    out[:, 0, :3] = right * scale
+    out[:, 1, :3] = up * scale
+    out[:, 2, :3] = -direction * scale
+    out[:, 3, :3] = 0.5 * (pos_a + pos_b)
+    out[:, :3, 3] = 0
+    out[:, 3, 3] = 1
+    return out
+
+
+class GPUScope:
+    __slots__ = ("timer", "name", "query", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.query = None
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.query = self.timer.begin()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.end(self.name, self.query, self.start)
+        return False
+
+
+# GL_TIME_ELAPSED queries reported to a Profiler as "gpu.<name>". Results are collected a few
+# frames late, once available, so reading them never stalls the pipeline. Scopes must not nest.
+class GPUTimer:
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.free = []
+        self.pending = deque()
+        try:
+            self.free.append(GPUTimer.gen_query())
+            self.available = True
+        except (GLError, NullFunctionError):
+            self.available = False
+
+    @staticmethod
+    def gen_query():
+        # A scalar or a one element array depending on the PyOpenGL platform
+        return int(np.ravel(glGenQueries(1))[0])
+
+    def scope(self, name):
+        if not (self.available and self.profiler.enabled):
+            return NULL_SCOPE
+        return GPUScope(self, name)
+
+    def begin(self):
+        query = self.free.pop() if self.free else GPUTimer.gen_query()
+        glBeginQuery(GL_TIME_ELAPSED, query)
+        return query
+
+    def end(self, name, query, start):
+        glEndQuery(GL_TIME_ELAPSED)
+        self.pending.append((name, query, start))
+
+    def collect(self):
+        while self.pending:
+            name, query, start = self.pending[0]
+            if not glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE):
+                break
+            elapsed = GLuint64()
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, elapsed)
+            self.profiler.record(f"gpu.{name}", start, elapsed.value * 1e-9)
+            self.pending.popleft()
+            self.free.append(query)
+
+    def destroy(self):
+        queries = self.free + [query for _, query, _ in self.pending]
+        if queries:
+            glDeleteQueries(len(queries), queries)
 
 
 def normalize_vector(v):
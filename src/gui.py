@@ -3,6 +3,7 @@ from OpenGL.GL import *
 
 from src.app import Window
 from src.model import Model
+from src.render_state import render_state
 from src.shader import Shader
 
 
@@ -17,7 +18,7 @@ class GUIText:
     def surfaceToTexture(pygame_surface):
         global texID
         rgb_surface = pg.image.tostring(pygame_surface, 'RGB')
-        glBindTexture(GL_TEXTURE_2D, texID)
+        render_state.bind_texture(0, GL_TEXTURE_2D, texID)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP)
@@ -26,7 +27,7 @@ class GUIText:
         glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, surface_rect.width, surface_rect.height, 0, GL_RGB, GL_UNSIGNED_BYTE,
                      rgb_surface)
         glGenerateMipmap(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, 0)
+        render_state.bind_texture(0, GL_TEXTURE_2D, 0)
 
     def render_text(self, font, string, location=(0, 0), color=pg.Color(255, 255, 255)):
         text = font.render(string, True, color)
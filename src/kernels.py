@@ -0,0 +1,158 @@
+import math
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+# Compiled counterparts of the Solver passes. They work in place on the ParticleStore arrays
+# and follow the same update rules as the NumPy implementation in src/verlet.py.
+
+@njit(cache=True)
+def apply_forces(pos_curr, pos_old, acceleration, gravity, friction):
+    for i in range(pos_curr.shape[0]):
+        dx = pos_curr[i, 0] - pos_old[i, 0]
+        dy = pos_curr[i, 1] - pos_old[i, 1]
+        dz = pos_curr[i, 2] - pos_old[i, 2]
+        dist = math.sqrt(dx * dx + dy * dy + dz * dz)
+        acceleration[i, 0] += gravity[0]
+        acceleration[i, 1] += gravity[1]
+        acceleration[i, 2] += gravity[2]
+        if dist > 0:
+            acceleration[i, 0] += dx / dist * friction
+            acceleration[i, 1] += dy / dist * friction
+            acceleration[i, 2] += dz / dist * friction
+
+
+@njit(cache=True)
+def update_positions(pos_curr, pos_old, acceleration, tag, dt):
+    dt2 = dt * dt
+    for i in range(pos_curr.shape[0]):
+        if tag[i] != 1:
+            for k in range(3):
+                displacement = pos_curr[i, k] - pos_old[i, k]
+                pos_old[i, k] = pos_curr[i, k]
+                pos_curr[i, k] += displacement + acceleration[i, k] * dt2
+        for k in range(3):
+            acceleration[i, k] = 0.0
+
+
+@njit(cache=True)
+def apply_sphere_constraint(pos_curr, radius, center, c_radius):
+    for i in range(pos_curr.shape[0]):
+        dx = pos_curr[i, 0] - center[0]
+        dy = pos_curr[i, 1] - center[1]
+        dz = pos_curr[i, 2] - center[2]
+        dist = math.sqrt(dx * dx + dy * dy + dz * dz)
+        limit = c_radius - radius[i]
+        if dist > limit:
+            pos_curr[i, 0] = center[0] + dx / dist * limit
+            pos_curr[i, 1] = center[1] + dy / dist * limit
+            pos_curr[i, 2] = center[2] + dz / dist * limit
+
+
+@njit(parallel=True, cache=True)
+def pair_corrections(pos_curr, radius, pairs):
+    corrections = np.zeros((pairs.shape[0], 3))
+    for p in prange(pairs.shape[0]):
+        i = pairs[p, 0]
+        j = pairs[p, 1]
+        dx = pos_curr[i, 0] - pos_curr[j, 0]
+        dy = pos_curr[i, 1] - pos_curr[j, 1]
+        dz = pos_curr[i, 2] - pos_curr[j, 2]
+        dist = math.sqrt(dx * dx + dy * dy + dz * dz)
+        min_dist = radius[i] + radius[j]
+        if 0 < dist < min_dist:
+            scale = 0.5 * (min_dist - dist) / dist
+            corrections[p, 0] = dx * scale
+            corrections[p, 1] = dy * scale
+            corrections[p, 2] = dz * scale
+    return corrections
+
+
+@njit(cache=True)
+def jacobi_collisions(pos_curr, radius, pairs, iterations, relaxation):
+    # Same as Solver.jacobi_collisions
+    contacts = np.empty(pos_curr.shape[0])
+    for _ in range(iterations):
+        corrections = pair_corrections(pos_curr, radius, pairs)
+        contacts[:] = 0
+        hits = 0
+        for p in range(pairs.shape[0]):
+            if corrections[p, 0] != 0 or corrections[p, 1] != 0 or corrections[p, 2] != 0:
+                contacts[pairs[p, 0]] += 1
+                contacts[pairs[p, 1]] += 1
+                hits += 1
+        if hits == 0:
+            return
+        summed = np.zeros_like(pos_curr)
+        for p in range(pairs.shape[0]):
+            i = pairs[p, 0]
+            j = pairs[p, 1]
+            for k in range(3):
+                summed[i, k] += corrections[p, k]
+                summed[j, k] -= corrections[p, k]
+        for i in range(pos_curr.shape[0]):
+            if contacts[i] > 0:
+                for k in range(3):
+                    pos_curr[i, k] += summed[i, k] * (relaxation / contacts[i])
+
+
+@njit(cache=True)
+def gauss_seidel_collisions(pos_curr, radius, pairs):
+    for p in range(pairs.shape[0]):
+        i = pairs[p, 0]
+        j = pairs[p, 1]
+        dx = pos_curr[i, 0] - pos_curr[j, 0]
+        dy = pos_curr[i, 1] - pos_curr[j, 1]
+        dz = pos_curr[i, 2] - pos_curr[j, 2]
+        dist = math.sqrt(dx * dx + dy * dy + dz * dz)
+        min_dist = radius[i] + radius[j]
+        if 0 < dist < min_dist:
+            scale = 0.5 * (min_dist - dist) / dist
+            pos_curr[i, 0] += dx * scale
+            pos_curr[i, 1] += dy * scale
+            pos_curr[i, 2] += dz * scale
+            pos_curr[j, 0] -= dx * scale
+            pos_curr[j, 1] -= dy * scale
+            pos_curr[j, 2] -= dz * scale
+
+
+@njit(cache=True)
+def apply_links(pos_curr, tag, link_a, link_b, target):
+    # Sequential in the given order, Solver.update_links passes the links sorted by color so the
+    # result matches LinkStore.apply
+    for l in range(link_a.shape[0]):
+        a = link_a[l]
+        b = link_b[l]
+        if tag[a] == 1 and tag[b] == 1:
+            continue
+        dx = pos_curr[a, 0] - pos_curr[b, 0]
+        dy = pos_curr[a, 1] - pos_curr[b, 1]
+        dz = pos_curr[a, 2] - pos_curr[b, 2]
+        dist = math.sqrt(dx * dx + dy * dy + dz * dz)
+        if dist == 0:
+            continue
+        delta = target[l] - dist
+        percent = 0.5
+        if tag[a] == 1:
+            percent = 0.0
+        elif tag[b] == 1:
+            percent = 1.0
+        pos_curr[a, 0] += percent * delta * dx / dist
+        pos_curr[a, 1] += percent * delta * dy / dist
+        pos_curr[a, 2] += percent * delta * dz / dist
+        pos_curr[b, 0] -= (1 - percent) * delta * dx / dist
+        pos_curr[b, 1] -= (1 - percent) * delta * dy / dist
+        pos_curr[b, 2] -= (1 - percent) * delta * dz / dist
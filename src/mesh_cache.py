@@ -0,0 +1,100 @@
+import hashlib
+import os
+import struct
+
+import numpy as np
+
+from src.obj_loader import load_obj_indexed
+
+# File layout: HEADER_SIZE byte header, then vertex_count * vertex_size float32 values, then
+# index_count indices of index_itemsize bytes (0 when the mesh is not indexed)
+MAGIC = b"VMSH"
+VERSION = 2
+HEADER = struct.Struct("<4sIQIQIQQ32s")
+HEADER_SIZE = 128
+EXTENSION = ".meshcache"
+
+
+def cache_path(source, cache_dir=None):
+    # Next to the asset by default, otherwise in cache_dir under a name unique to the source path
+    if cache_dir is None:
+        return source + EXTENSION
+    key = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{os.path.basename(source)}.{key}{EXTENSION}")
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def write_cache(path, source, vertices, indices=None):
+    stat = os.stat(source)
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+    index_count = 0 if indices is None else len(indices)
+    index_itemsize = 0 if indices is None else indices.dtype.itemsize
+    header = HEADER.pack(MAGIC, VERSION, len(vertices), vertices.shape[1], index_count, index_itemsize,
+                         stat.st_size, stat.st_mtime_ns, file_digest(source))
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(vertices.tobytes())
+        if indices is not None:
+            f.write(np.ascontiguousarray(indices).tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_cache(path, source):
+    # Memory-mapped (vertices, indices) when the cache matches the source, otherwise None
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        (magic, version, vertex_count, vertex_size, index_count, index_itemsize,
+         source_size, source_mtime, digest) = HEADER.unpack(header)
+        stat = os.stat(source)
+    except (OSError, struct.error):
+        return None
+    if magic != MAGIC or version != VERSION:
+        return None
+    if (stat.st_size, stat.st_mtime_ns) != (source_size, source_mtime):
+        # Touched but possibly unchanged (e.g. a fresh checkout), fall back to the content hash
+        if stat.st_size != source_size or file_digest(source) != digest:
+            return None
+        try:
+            with open(path, "r+b") as f:
+                f.write(HEADER.pack(magic, version, vertex_count, vertex_size, index_count, index_itemsize,
+                                    stat.st_size, stat.st_mtime_ns, digest))
+        except OSError:
+            pass
+
+    vertex_bytes = vertex_count * vertex_size * 4
+    if os.path.getsize(path) != HEADER_SIZE + vertex_bytes + index_count * index_itemsize:
+        return None
+    if vertex_count == 0:
+        vertices = np.zeros((0, vertex_size), dtype=np.float32)
+    else:
+        vertices = np.memmap(path, dtype=np.float32, mode="r", offset=HEADER_SIZE,
+                             shape=(vertex_count, vertex_size))
+    indices = None
+    if index_count:
+        indices = np.memmap(path, dtype=np.dtype(f"<u{index_itemsize}"), mode="r",
+                            offset=HEADER_SIZE + vertex_bytes, shape=(index_count,))
+    return vertices, indices
+
+
+def load_cached_obj(source, cache_dir=None):
+    # Deduplicated (vertices, indices) of an OBJ file, see obj_loader.load_obj_indexed
+    path = cache_path(source, cache_dir)
+    cached = read_cache(path, source)
+    if cached is not None and cached[1] is not None:
+        return cached
+    vertices, indices = load_obj_indexed(source)
+    try:
+        write_cache(path, source, vertices, indices)
+    except OSError:
+        pass  # read-only asset directory, keep the parsed mesh
+    return vertices, indices
@@ -1,8 +1,12 @@
 import pygame as pg
-import pyrr
 from OpenGL.GL import *
 import numpy as np
 
+from src.mesh_cache import load_cached_obj
+from src.obj_loader import load_obj_indexed
+from src.render_state import render_state
+from src.transform import Transform
+
 
 class Model:
 
@@ -14,58 +18,76 @@ class Model:
         else:
             self.mesh = Mesh(filename)
             Model.mesh_list[filename] = self.mesh
-        self.position = np.array(position, dtype=np.float32)
-        self.rotation = np.array(rotation, dtype=np.float32)
-        self.scale = scale
-        self.model = None
+        self.transform = Transform(position, np.radians(rotation), scale)
         self.render_method = GL_TRIANGLES
 
-    def update_transformation(self):
-        self.model = pyrr.matrix44.create_identity(dtype=np.float32)
-        self.model = pyrr.matrix44.multiply(
-            m1=self.model,
-            m2=pyrr.matrix44.create_from_scale(self.scale)
-        )
-        self.model = pyrr.matrix44.multiply(
-            m1=self.model,
-            m2=pyrr.matrix44.create_from_eulers(
-                eulers=np.radians(self.rotation),
-                dtype=np.float32
-            )
-        )
-        self.model = pyrr.matrix44.multiply(
-            m1=self.model,
-            m2=pyrr.matrix44.create_from_translation(
-                vec=np.array(self.position),
-                dtype=np.float32
-            )
-        )
+    @property
+    def position(self):
+        return self.transform.position
+
+    @position.setter
+    def position(self, value):
+        self.transform.position = value
+
+    @property
+    def rotation(self):
+        # Degrees
+        return np.degrees(self.transform.rotation)
+
+    @rotation.setter
+    def rotation(self, value):
+        self.transform.rotation = np.radians(value)
+
+    @property
+    def scale(self):
+        return self.transform.scale
+
+    @scale.setter
+    def scale(self, value):
+        self.transform.scale = value
+
+    @property
+    def model(self):
+        return self.transform.matrix
 
     def render(self, modelMatrixLocation):
-        self.update_transformation()
-        glUniformMatrix4fv(modelMatrixLocation, 1, GL_FALSE, self.model)
+        glUniformMatrix4fv(modelMatrixLocation, 1, GL_FALSE, self.transform.matrix)
         # self.texture.use()
-        glBindVertexArray(self.mesh.vao)
-        glDrawArrays(self.render_method, 0, self.mesh.vertex_count)
+        render_state.bind_vertex_array(self.mesh.vao)
+        self.mesh.draw(self.render_method)
 
     def destroy(self):
         self.mesh.destroy()
 
 
 class Mesh:
+    use_cache = True
+    cache_dir = None  # None = next to the .obj
+
     def __init__(self, filename):
-        self.vertices = []
         self.load_mesh(filename)
-        self.vertex_count = len(self.vertices) // 8
-        self.vertices = np.array(self.vertices, dtype=np.float32)
+        self.vertex_count = len(self.vertices)
+        self.index_count = len(self.indices)
+        self.index_type = GL_UNSIGNED_SHORT if self.indices.dtype == np.uint16 else GL_UNSIGNED_INT
 
         self.vao = glGenVertexArrays(1)
-        glBindVertexArray(self.vao)
+        render_state.bind_vertex_array(self.vao)
 
         # Vertices
         self.vbo = glGenBuffers(1)
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
         glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, self.vertices, GL_STATIC_DRAW)
+
+        # Indices
+        self.ebo = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.indices.nbytes, self.indices, GL_STATIC_DRAW)
+        self.bind_attributes()
+
+    def bind_attributes(self):
+        # Buffers and attribute layout of the bound VAO: 0 = position, 1 = normal, 2 = texture coordinate
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
         stride = (3 + 3 + 2) * 4
         # Position
         glEnableVertexAttribArray(0)
@@ -78,47 +100,43 @@ class Mesh:
         glVertexAttribPointer(2, 2, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(24))
 
     def load_mesh(self, filename):
-        v = []
-        vt = []
-        vn = []
-        with open(filename, "r") as file:
-            line = file.readline()
-            while line:
-                words = line.split(" ")
-                if words[0] == "v":
-                    v.append([float(words[1]), float(words[2]), float(words[3])])
-                elif words[0] == "vt":
-                    vt.append([float(words[1]), float(words[2])])
-                elif words[0] == "vn":
-                    vn.append([float(words[1]), float(words[2]), float(words[3])])
-                elif words[0] == "f":
-                    v1 = words[1].split("/")
-                    v2 = words[2].split("/")
-                    v3 = words[3].strip().split("/")
-                    self.process_vertex(v1, v, vt, vn)
-                    self.process_vertex(v2, v, vt, vn)
-                    self.process_vertex(v3, v, vt, vn)
-
-                line = file.readline()
-
-    def process_vertex(self, vertex_data, v, vt, vn):
-        vertex_ptr = int(vertex_data[0]) - 1
-        texture_ptr = int(vertex_data[1]) - 1
-        normal_ptr = int(vertex_data[2]) - 1
-        self.vertices = self.vertices + v[vertex_ptr]
-        self.vertices = self.vertices + vn[normal_ptr]
-        self.vertices = self.vertices + vt[texture_ptr]
+        if Mesh.use_cache:
+            self.vertices, self.indices = load_cached_obj(filename, Mesh.cache_dir)
+        else:
+            self.vertices, self.indices = load_obj_indexed(filename)
+
+    def draw(self, method=GL_TRIANGLES):
+        # Expects this mesh's VAO (or one set up with bind_attributes) to be bound
+        glDrawElements(method, self.index_count, self.index_type, None)
+
+    def draw_instanced(self, instance_count, method=GL_TRIANGLES):
+        glDrawElementsInstanced(method, self.index_count, self.index_type, None, instance_count)
+
+    def memory_stats(self):
+        # Buffer sizes against the old fully expanded layout (one 32 byte vertex per face corner)
+        vertex_bytes = self.vertices.nbytes
+        index_bytes = self.indices.nbytes
+        expanded_bytes = self.index_count * self.vertices.shape[1] * 4
+        return {
+            "vertex_count": self.vertex_count,
+            "index_count": self.index_count,
+            "vertex_bytes": vertex_bytes,
+            "index_bytes": index_bytes,
+            "expanded_bytes": expanded_bytes,
+            "saved_bytes": expanded_bytes - vertex_bytes - index_bytes,
+        }
 
     def destroy(self):
+        render_state.forget_vertex_array(self.vao)
         glDeleteVertexArrays(1, (self.vao,))
-        glDeleteBuffers(1, (self.vbo,))
+        glDeleteBuffers(2, (self.vbo, self.ebo))
 
 
 class Texture:
 
     def __init__(self, filepath):
         self.texture = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, self.texture)
+        render_state.bind_texture(0, GL_TEXTURE_2D, self.texture)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
@@ -130,8 +148,8 @@ class Texture:
         glGenerateMipmap(GL_TEXTURE_2D)
 
     def use(self):
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.texture)
+        render_state.bind_texture(0, GL_TEXTURE_2D, self.texture)
 
     def destroy(self):
+        render_state.forget_texture(self.texture)
         glDeleteTextures(1, (self.texture,))
@@ -0,0 +1,113 @@
+import numpy as np
+
+
+def parse_rows(rows, width):
+    # Whitespace separated float rows, padded/truncated to `width` columns
+    if not rows:
+        return np.zeros((0, width), dtype=np.float64)
+    values = np.array(" ".join(rows).split(), dtype=np.float64)
+    if len(values) == len(rows) * width:
+        return values.reshape(-1, width)
+    # Rows with optional extras (w, vertex colors) or missing components
+    return np.array([(row.split() + ["0"] * width)[:width] for row in rows], dtype=np.float64)
+
+
+def normalize_corner(token):
+    # "v", "v/vt", "v//vn" and "v/vt/vn" all become "v/vt/vn" with 0 for a missing index
+    fields = (token + "//").split("/")[:3]
+    return "/".join(field or "0" for field in fields)
+
+
+# Positions (V, 3), texture coordinates (T, 2), normals (N, 3) and triangle corners. Corners are an
+# (M, 3) int64 array of zero-based (v, vt, vn) indices, three rows per triangle, with -1 where a face
+# gives no vt or vn. Polygons are fan-triangulated.
+def read_obj(filename):
+    with open(filename, "r") as file:
+        lines = file.read().splitlines()
+
+    v_rows, vt_rows, vn_rows = [], [], []
+    corner_tokens = []
+    face_sizes = []
+    seen = []  # (v, vt, vn) counts when each face was read, for negative indices
+    for line in lines:
+        keyword, _, rest = line.strip().partition(" ")
+        if keyword == "v":
+            v_rows.append(rest)
+        elif keyword == "vt":
+            vt_rows.append(rest)
+        elif keyword == "vn":
+            vn_rows.append(rest)
+        elif keyword == "f":
+            tokens = rest.split()
+            corner_tokens.extend(tokens)
+            face_sizes.append(len(tokens))
+            seen.append((len(v_rows), len(vt_rows), len(vn_rows)))
+
+    v = parse_rows(v_rows, 3)
+    vt = parse_rows(vt_rows, 2)
+    vn = parse_rows(vn_rows, 3)
+    if not face_sizes:
+        return v, vt, vn, np.zeros((0, 3), dtype=np.int64)
+
+    text = " ".join(normalize_corner(token) for token in corner_tokens).replace("/", " ")
+    indices = np.array(text.split(), dtype=np.int64).reshape(-1, 3)
+    face_sizes = np.array(face_sizes, dtype=np.int64)
+
+    # 1-based indices count from the start, negative ones back from the last element read so far,
+    # 0 marks a missing index
+    counts = np.repeat(np.array(seen, dtype=np.int64), face_sizes, axis=0)
+    indices = np.where(indices > 0, indices - 1, np.where(indices < 0, counts + indices, -1))
+
+    # Fan triangulation: corners (0, i, i + 1) of every face
+    triangles = face_sizes - 2
+    face_start = np.cumsum(face_sizes) - face_sizes
+    first = np.repeat(face_start, triangles)
+    step = np.arange(triangles.sum()) - np.repeat(np.cumsum(triangles) - triangles, triangles) + 1
+    order = np.column_stack((first, first + step, first + step + 1)).ravel()
+    return v, vt, vn, indices[order]
+
+
+def interleave(v, vt, vn, corners):
+    # (M, 8) float32 rows of position, normal, texture coordinate, the layout Mesh uploads
+    vertices = np.zeros((len(corners), 8), dtype=np.float32)
+    vertices[:, 0:3] = v[corners[:, 0]]
+
+    has_vt = corners[:, 1] >= 0
+    vertices[has_vt, 6:8] = vt[corners[has_vt, 1]]
+
+    has_vn = corners[:, 2] >= 0
+    vertices[has_vn, 3:6] = vn[corners[has_vn, 2]]
+    if not has_vn.all():
+        # Flat normals for triangles without vn
+        positions = vertices[:, 0:3].reshape(-1, 3, 3)
+        normals = np.cross(positions[:, 1] - positions[:, 0], positions[:, 2] - positions[:, 0])
+        length = np.linalg.norm(normals, axis=1)
+        normals[length > 0] /= length[length > 0, None]
+        flat = np.repeat(normals, 3, axis=0)
+        vertices[~has_vn, 3:6] = flat[~has_vn]
+    return vertices
+
+
+def index_vertices(v, vt, vn, corners):
+    # Unique vertex rows plus a per-corner index array. Corners sharing a (v, vt, vn) triple share a
+    # vertex, corners without vn keep their flat normal and only merge within their triangle.
+    vertices = interleave(v, vt, vn, corners)
+    key = corners.copy()
+    no_vn = key[:, 2] < 0
+    key[no_vn, 2] = -2 - np.nonzero(no_vn)[0] // 3
+    _, first, inverse = np.unique(key, axis=0, return_index=True, return_inverse=True)
+    # Number the unique vertices in order of first use, which keeps the index stream cache friendly
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    indices = rank[inverse.reshape(-1)]
+    dtype = np.uint16 if len(first) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    return vertices[first[order]], indices.astype(dtype)
+
+
+def load_obj(filename):
+    return interleave(*read_obj(filename))
+
+
+def load_obj_indexed(filename):
+    return index_vertices(*read_obj(filename))
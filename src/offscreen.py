@@ -0,0 +1,335 @@
+import os
+
+# PyOpenGL binds its platform on first import, so this has to run before anything imports OpenGL.
+# EGL by default, run with PYOPENGL_PLATFORM=osmesa for Mesa's pure software context instead.
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+# Lets Mesa's EGL start without a display server
+os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+# Keeps pygame's import banner out of frames written to stdout
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import ctypes
+import struct
+import subprocess
+import sys
+import time
+import zlib
+
+import numpy as np
+from OpenGL.GL import *
+
+from src.app import Window
+from src.render_state import render_state
+from src.verlet import Solver
+
+
+class EGLContext:
+
+    def __init__(self, width, height):
+        from OpenGL import EGL
+
+        self.egl = EGL
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError("eglInitialize failed")
+
+        config_attributes = (EGL.EGLint * 13)(
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT, EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8,
+            EGL.EGL_BLUE_SIZE, 8, EGL.EGL_DEPTH_SIZE, 24, EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_NONE
+        )
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        EGL.eglChooseConfig(self.display, config_attributes, ctypes.pointer(config), 1, ctypes.pointer(count))
+        if count.value == 0:
+            raise RuntimeError("No EGL config supports desktop OpenGL")
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+        context_attributes = (EGL.EGLint * 7)(
+            EGL.EGL_CONTEXT_MAJOR_VERSION, 3, EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT, EGL.EGL_NONE
+        )
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, context_attributes)
+        if not self.context:
+            raise RuntimeError("Could not create a GL 3.3 core context through EGL")
+        # Frames go to a Framebuffer, the pbuffer only has to make the context current
+        self.surface = EGL.eglCreatePbufferSurface(self.display, config,
+                                                   (EGL.EGLint * 5)(EGL.EGL_WIDTH, 1, EGL.EGL_HEIGHT, 1,
+                                                                    EGL.EGL_NONE))
+        EGL.eglMakeCurrent(self.display, self.surface, self.surface, self.context)
+
+    def destroy(self):
+        EGL = self.egl
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroySurface(self.display, self.surface)
+        EGL.eglDestroyContext(self.display, self.context)
+        EGL.eglTerminate(self.display)
+
+
+class OSMesaContext:
+
+    def __init__(self, width, height):
+        from OpenGL import osmesa, arrays
+
+        self.osmesa = osmesa
+        attributes = arrays.GLintArray.asArray([
+            osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA, osmesa.OSMESA_DEPTH_BITS, 24,
+            osmesa.OSMESA_STENCIL_BITS, 8, osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+            osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 3, osmesa.OSMESA_CONTEXT_MINOR_VERSION, 3, 0
+        ])
+        self.context = osmesa.OSMesaCreateContextAttribs(attributes, None)
+        if not self.context:
+            raise RuntimeError("Could not create a GL 3.3 core context through OSMesa")
+        # OSMesa needs a color buffer to make the context current, frames still go to a Framebuffer
+        self.buffer = arrays.GLubyteArray.zeros((height, width, 4))
+        if not osmesa.OSMesaMakeCurrent(self.context, self.buffer, GL_UNSIGNED_BYTE, width, height):
+            raise RuntimeError("OSMesaMakeCurrent failed")
+
+    def destroy(self):
+        self.osmesa.OSMesaDestroyContext(self.context)
+
+
+def create_context(width, height):
+    platform = os.environ["PYOPENGL_PLATFORM"]
+    if platform == "egl":
+        return EGLContext(width, height)
+    if platform == "osmesa":
+        return OSMesaContext(width, height)
+    raise ValueError(f"Unsupported offscreen platform: {platform}")
+
+
+# Color and depth-stencil renderbuffers to draw into instead of a window's default framebuffer
+class Framebuffer:
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        self.color, self.depth = glGenRenderbuffers(2)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.color)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.color)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER, self.depth)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("Offscreen framebuffer is incomplete")
+        glViewport(0, 0, width, height)
+
+    def destroy(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDeleteRenderbuffers(2, (self.color, self.depth))
+        glDeleteFramebuffers(1, (self.fbo,))
+
+
+# Reads frames back through a ring of pixel pack buffers. read() starts the copy of the current
+# frame and returns the one started `buffers - 1` calls earlier, so the GPU finishes each copy while
+# the next frames render. Returned frames are top-down (height, width, 4) uint8 views into one
+# preallocated array, valid until the next call.
+class FrameReader:
+
+    def __init__(self, width, height, buffers=2):
+        self.width = width
+        self.height = height
+        self.frame = np.empty((height, width, 4), dtype=np.uint8)
+        self.pbos = [int(pbo) for pbo in np.atleast_1d(glGenBuffers(buffers))]
+        for pbo in self.pbos:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.frame.nbytes, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.index = 0
+        self.pending = 0
+
+    def read(self):
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[self.index])
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.index = (self.index + 1) % len(self.pbos)
+        self.pending += 1
+        if self.pending < len(self.pbos):
+            return None
+        return self.take()
+
+    def flush(self):
+        # Frames still in flight, oldest first
+        while self.pending:
+            yield self.take()
+
+    def take(self):
+        # Oldest pending copy, which sits in the buffer the next read() would overwrite
+        oldest = (self.index - self.pending) % len(self.pbos)
+        self.pending -= 1
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[oldest])
+        pointer = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self.frame.nbytes, GL_MAP_READ_BIT)
+        ctypes.memmove(self.frame.ctypes.data, pointer, self.frame.nbytes)
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        # GL rows start at the bottom
+        return self.frame[::-1]
+
+    def destroy(self):
+        glDeleteBuffers(len(self.pbos), self.pbos)
+
+
+# Numbered RGB PNG files, written with zlib only
+class PNGSequence:
+
+    def __init__(self, directory, prefix="frame", compression=3):
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    def write(self, frame):
+        height, width = frame.shape[:2]
+        # Filter type 0 (none) in front of every row
+        rows = np.zeros((height, 1 + width * 3), dtype=np.uint8)
+        rows[:, 1:] = frame[:, :, :3].reshape(height, -1)
+        png = b"".join((
+            b"\x89PNG\r\n\x1a\n",
+            PNGSequence.chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)),
+            PNGSequence.chunk(b"IDAT", zlib.compress(rows.tobytes(), self.compression)),
+            PNGSequence.chunk(b"IEND", b""),
+        ))
+        path = os.path.join(self.directory, f"{self.prefix}_{self.count:05d}.png")
+        with open(path, "wb") as f:
+            f.write(png)
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+# Raw rgba frames, back to back, to a file, stdout ("-") or the stdin of a command such as
+# ffmpeg -f rawvideo -pix_fmt rgba -s 1400x900 -r 60 -i - out.mp4
+class RawVideo:
+
+    def __init__(self, path=None, command=None):
+        self.process = None
+        if command is not None:
+            self.process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE)
+            self.stream = self.process.stdin
+        elif path == "-":
+            self.stream = sys.stdout.buffer
+        else:
+            self.stream = open(path, "wb")
+        self.count = 0
+
+    def write(self, frame):
+        self.stream.write(np.ascontiguousarray(frame).data)
+        self.count += 1
+
+    def close(self):
+        if self.stream is sys.stdout.buffer:
+            self.stream.flush()
+            return
+        self.stream.close()
+        if self.process is not None:
+            self.process.wait()
+
+
+# Window's scene and render path drawn into a Framebuffer of an EGL or OSMesa context, with every
+# frame passed to `sink` (PNGSequence, RawVideo or anything with write(frame) and close()).
+# Simulation and camera time advance by 1 / fps per frame, independent of how long rendering takes.
+class OffscreenWindow(Window):
+
+    def __init__(self, frames, sink, width=Window.WIDTH, height=Window.HEIGHT, fps=60, seed=None,
+                 impostors=False, profile=False, trace_path=None, time_scale=0.09, playback=None, cloth_size=0):
+        self.WIDTH = width
+        self.HEIGHT = height
+        self.frames = frames
+        self.sink = sink
+        self.fps = fps
+        self.seed = seed
+        self.use_impostors = impostors
+        super().__init__(profile=profile, trace_path=trace_path, time_scale=time_scale, playback=playback,
+                         cloth_size=cloth_size)
+
+    def create_display(self):
+        self.context = create_context(self.WIDTH, self.HEIGHT)
+        render_state.invalidate()
+        self.framebuffer = Framebuffer(self.WIDTH, self.HEIGHT)
+        self.reader = FrameReader(self.WIDTH, self.HEIGHT)
+
+    def run(self):
+        self.spawner.rng = np.random.default_rng(self.seed)
+        self.impostors = self.use_impostors
+        start = time.perf_counter()
+        for frame in range(self.frames):
+            self.global_time = frame / self.fps
+            self.dt = 1000 / self.fps
+            frame_start = time.perf_counter()
+            if self.fix_camera:
+                self.orbit_camera()
+
+            self.render_frame()
+
+            with self.profiler.scope("readback"):
+                pixels = self.reader.read()
+            if pixels is not None:
+                with self.profiler.scope("write"):
+                    self.sink.write(pixels)
+            self.gpu_timer.collect()
+            if self.profiler.enabled:
+                self.profiler.record("frame", frame_start, time.perf_counter() - frame_start)
+
+        for pixels in self.reader.flush():
+            self.sink.write(pixels)
+        elapsed = time.perf_counter() - start
+        print(f"{self.frames} frames in {elapsed:.2f} s ({self.frames / elapsed:.1f} frames/s)", file=sys.stderr)
+        self.quit()
+
+    def quit(self):
+        self.sink.close()
+        self.reader.destroy()
+        self.framebuffer.destroy()
+        super().quit()
+        self.context.destroy()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render the simulation without a display. Uses EGL, or OSMesa when run with "
+                    "PYOPENGL_PLATFORM=osmesa."
+    )
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=Window.WIDTH)
+    parser.add_argument("--height", type=int, default=Window.HEIGHT)
+    parser.add_argument("--fps", type=float, default=60, help="simulated frames per second of output")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--impostors", action="store_true", help="draw balls as ray-cast point sprites")
+    parser.add_argument("--time-scale", type=float, default=0.09, help="simulated seconds per real second")
+    parser.add_argument("--sub-steps", type=int, default=Solver.sub_steps, help="solver sub-steps per step")
+    parser.add_argument("--play", metavar="PATH", help="replay a trajectory recorded with src.simulate --record")
+    parser.add_argument("--cloth", type=int, default=0,
+                        help="hang an N x N cloth pinned at its corners in the container")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--png", metavar="DIR", help="write a numbered PNG sequence to this directory")
+    output.add_argument("--raw", metavar="PATH", help="write raw rgba frames to this file, - for stdout")
+    output.add_argument("--pipe", metavar="COMMAND", help="pipe raw rgba frames into this shell command")
+    parser.add_argument("--profile", action="store_true", help="print per-phase frame timings on exit")
+    parser.add_argument("--trace", help="write a Chrome trace JSON to this path on exit")
+    args = parser.parse_args()
+    Solver.sub_steps = args.sub_steps
+
+    if args.png is not None:
+        sink = PNGSequence(args.png)
+    else:
+        sink = RawVideo(path=args.raw, command=args.pipe)
+    OffscreenWindow(args.frames, sink, width=args.width, height=args.height, fps=args.fps, seed=args.seed,
+                    impostors=args.impostors, profile=args.profile, trace_path=args.trace,
+                    time_scale=args.time_scale, playback=args.play, cloth_size=args.cloth)
+
+
+if __name__ == "__main__":
+    main()
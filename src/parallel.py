@@ -0,0 +1,236 @@
+import multiprocessing as mp
+import os
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src.verlet import Container, ParticleStore, Solver
+
+# Layout of the shared control block the main process fills before every step
+COMMAND, COUNT, SUB_DT, FRICTION, HALO, SCALE, ITERATIONS, RELAXATION = range(8)
+GRAVITY = slice(8, 11)
+POSITION = slice(11, 14)
+EDGES = 14  # workers + 1 slab edges along x from here on
+RUN, STOP = 1.0, 0.0
+
+
+def attach(name, shape, dtype):
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+# ParticleStore whose fields live in shared memory blocks, so worker processes can map the same
+# arrays. Growing replaces the blocks and bumps `generation`, workers have to attach again.
+class SharedParticleStore(ParticleStore):
+
+    def __init__(self, capacity=64):
+        self.blocks = []  # One per field, allocated in ParticleStore.FIELDS order
+        self.generation = 0
+        super().__init__(capacity)
+
+    def allocate(self, shape, dtype):
+        size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        array.fill(0)
+        self.blocks.append(block)
+        return array
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        old_blocks = self.blocks
+        self.blocks = []
+        super().reserve(capacity)
+        for block in old_blocks:
+            self.release(block)
+        self.generation += 1
+
+    def spec(self):
+        # (field, block name, shape, dtype) per field, enough for attach() in another process
+        return [(field, block.name, getattr(self, field).shape, getattr(self, field).dtype.str)
+                for field, block in zip(ParticleStore.FIELDS, self.blocks)]
+
+    @staticmethod
+    def release(block):
+        block.close()
+        block.unlink()
+
+    def close(self):
+        for field in ParticleStore.FIELDS:
+            setattr(self, field, getattr(self, field).copy())
+        for block in self.blocks:
+            self.release(block)
+        self.blocks = []
+
+
+def worker_main(index, workers, spec, control_name, barrier, backend, broadphase):
+    # One slab: every substep gathers the particles in it plus a halo into a private store, runs the
+    # regular serial pipeline on them and writes back only the rows it owns. Ownership follows the
+    # positions, so particles crossing an edge migrate to the neighbouring worker next substep.
+    blocks = []
+    shared = ParticleStore(capacity=0)
+    for field, name, shape, dtype in spec:
+        block, array = attach(name, tuple(shape), np.dtype(dtype))
+        blocks.append(block)
+        setattr(shared, field, array)
+    control_block, control = attach(control_name, (EDGES + workers + 1,), np.float64)
+    blocks.append(control_block)
+
+    local = Solver(Container(), backend=backend)
+    local.broadphase = broadphase
+    local.skin = 0  # The local store is refilled every substep, a neighbor list would never be reused
+    try:
+        while True:
+            barrier.wait()
+            if control[COMMAND] == STOP:
+                break
+            n = int(control[COUNT])
+            halo = control[HALO]
+            lower, upper = control[EDGES + index], control[EDGES + index + 1]
+            Solver.gravity = control[GRAVITY].copy()
+            Solver.friction = control[FRICTION]
+            Solver.jacobi_iterations = int(control[ITERATIONS])
+            Solver.jacobi_relaxation = control[RELAXATION]
+            local.container.position = control[POSITION].copy()
+            local.container.scale = control[SCALE]
+
+            shared.count = n
+            x = shared.pos_curr[:, 0]
+            rows = np.flatnonzero((x >= lower - halo) & (x < upper + halo))
+            owned = (x[rows] >= lower) & (x[rows] < upper)
+            local.store.copy_rows(shared, rows)
+            # Everyone has read the substep's starting positions, rows can now be overwritten
+            barrier.wait()
+
+            local.step(control[SUB_DT])
+            mine = rows[owned]
+            shared.pos_curr[mine] = local.store.pos_curr[owned]
+            shared.pos_old[mine] = local.store.pos_old[owned]
+            shared.acceleration[mine] = local.store.acceleration[owned]
+            barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        # Views into the blocks have to go before the blocks can close
+        shared = control = None
+        for block in blocks:
+            block.close()
+
+
+# Solver that splits the particles into `workers` slabs along x and steps them in parallel
+# processes over shared memory. Collisions are resolved Jacobi style from the positions at the
+# start of each substep, so the result matches the serial Solver up to summation order. Links are
+# still applied serially by the calling process after every substep. Call close() when done.
+class ParallelSolver(Solver):
+    workers = None  # Defaults to os.cpu_count()
+    start_method = "spawn"  # Safe next to GL contexts and threaded BLAS, unlike fork
+
+    def __init__(self, container, verlet_objects=(), backend=None, workers=None):
+        super().__init__(container, backend=backend)
+        if workers is not None:
+            self.workers = workers
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+        self.store = SharedParticleStore()
+        self.processes = []
+        self.barrier = None
+        self.control_block = None
+        self.control = None
+        self.generation = None
+        for obj in verlet_objects:
+            self.add_object(obj)
+
+    def start(self):
+        # (Re)starts the workers on the current shared blocks
+        self.stop()
+        if self.collision_mode != "jacobi":
+            raise ValueError("ParallelSolver only supports the jacobi collision mode")
+        context = mp.get_context(self.start_method)
+        self.control_block = shared_memory.SharedMemory(create=True, size=(EDGES + self.workers + 1) * 8)
+        self.control = np.ndarray((EDGES + self.workers + 1,), dtype=np.float64, buffer=self.control_block.buf)
+        self.control.fill(0)
+        self.barrier = context.Barrier(self.workers + 1)
+        spec = self.store.spec()
+        self.processes = [
+            context.Process(target=worker_main, daemon=True,
+                            args=(index, self.workers, spec, self.control_block.name, self.barrier,
+                                  self.backend, self.broadphase))
+            for index in range(self.workers)
+        ]
+        for process in self.processes:
+            process.start()
+        self.generation = self.store.generation
+
+    def stop(self):
+        if not self.processes:
+            return
+        self.control[COMMAND] = STOP
+        try:
+            self.barrier.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        self.control = None
+        self.control_block.close()
+        self.control_block.unlink()
+        self.control_block = None
+
+    def close(self):
+        self.stop()
+        self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def wait(self):
+        try:
+            self.barrier.wait()
+        except threading.BrokenBarrierError:
+            self.processes = [process for process in self.processes if process.is_alive()]
+            raise RuntimeError("A ParallelSolver worker failed, see its traceback above") from None
+
+    def update(self):
+        count = self.store.count
+        if count == 0:
+            return
+        if self.generation != self.store.generation or not self.processes:
+            self.start()
+
+        # Slab edges at the particle quantiles along x, rebalanced every step
+        x = self.store.pos_curr[:, 0]
+        control = self.control
+        edges = control[EDGES:]
+        edges[1:-1] = np.quantile(x, np.linspace(0, 1, self.workers + 1)[1:-1])
+        edges[0], edges[-1] = -np.inf, np.inf
+        control[COUNT] = count
+        control[SUB_DT] = Solver.time_step / Solver.sub_steps
+        control[FRICTION] = Solver.friction
+        control[GRAVITY] = Solver.gravity
+        control[POSITION] = self.container.position
+        control[SCALE] = self.container.scale
+        control[ITERATIONS] = Solver.jacobi_iterations
+        control[RELAXATION] = Solver.jacobi_relaxation
+        # Any contact of an owned particle is with someone less than two max radii away, and every
+        # further Jacobi pass depends on the contacts of those one more contact away
+        control[HALO] = 2 * self.store.radius.max() * max(Solver.jacobi_iterations, 1)
+        control[COMMAND] = RUN
+
+        for step in range(Solver.sub_steps):
+            with self.profiler.scope("solver.parallel_step"):
+                self.wait()  # Workers gather their slab and halo
+                self.wait()  # Workers step and write back
+                self.wait()
+            with self.profiler.scope("solver.update_links"):
+                self.update_links()
@@ -0,0 +1,94 @@
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+
+class NullScope:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SCOPE = NullScope()
+
+
+class Scope:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+# Named scoped timers with a rolling window of samples per name and an optional Chrome trace.
+# While disabled, scope() hands out a shared no-op context manager.
+class Profiler:
+
+    def __init__(self, enabled=False, window=600, trace=False, max_events=1_000_000):
+        self.enabled = enabled
+        self.window = window
+        self.trace = trace
+        self.max_events = max_events
+        self.samples = {}
+        self.events = []
+        self.origin = time.perf_counter()
+
+    def scope(self, name):
+        if not self.enabled:
+            return NULL_SCOPE
+        return Scope(self, name)
+
+    def record(self, name, start, duration):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+        samples.append(duration)
+        if self.trace and len(self.events) < self.max_events:
+            self.events.append({
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": 0,
+                "tid": 1 if name.startswith("gpu.") else 0,
+            })
+
+    def percentiles(self, name):
+        samples = np.fromiter(self.samples[name], dtype=np.float64)
+        p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+        return {"p50": p50, "p95": p95, "p99": p99, "mean": samples.mean(), "count": len(samples)}
+
+    def summary(self):
+        lines = [f"{'phase':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'count':>8}"]
+        for name in self.samples:
+            stats = self.percentiles(name)
+            lines.append(f"{name:<28}{stats['p50'] * 1000:>10.3f}{stats['p95'] * 1000:>10.3f}"
+                         f"{stats['p99'] * 1000:>10.3f}{stats['count']:>8}")
+        return "\n".join(lines)
+
+    def save_trace(self, path):
+        # Chrome trace event format, open with chrome://tracing or ui.perfetto.dev
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+    def reset(self):
+        self.samples.clear()
+        self.events.clear()
+
+
+# Shared instance the Window and Solver report through
+profiler = Profiler()
@@ -0,0 +1,357 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from src.verlet import Container, LinkStore, Solver
+
+# Checkpoints are plain .npz archives with one array per piece of solver state, see save_checkpoint
+CHECKPOINT_VERSION = 1
+
+# Trajectory file layout: HEADER padded to HEADER_SIZE bytes, then chunks until the end of the file.
+# A chunk is CHUNK followed by counts uint32[frames] (particles present in each frame), radius
+# float32[count], link_a int32[links], link_b int32[links] and positions[frames, count, 3] with
+# itemsize bytes per value. Particles are only ever appended within a chunk, rows of frames before
+# one appeared hold its first position. uint16 positions are fixed point over
+# [offset - scale, offset + scale] per axis of the chunk, float32 ones are stored as is.
+MAGIC = b"VTRJ"
+VERSION = 2
+HEADER = struct.Struct("<4sIId")  # magic, version, itemsize, simulated seconds per frame
+HEADER_SIZE = 64
+CHUNK = struct.Struct("<IIQ6d")  # frames, count, links, offset xyz, scale xyz
+UINT16_STEPS = np.iinfo(np.uint16).max
+
+
+def save_checkpoint(path, solver, schedule=None):
+    # Everything needed to continue the run: particles, links, container and the Solver settings.
+    # schedule (e.g. simulate.SpawnSchedule) is saved too when given.
+    store = solver.store
+    links = solver.links
+    arrays = {
+        "version": np.int64(CHECKPOINT_VERSION),
+        "pos_curr": store.pos_curr,
+        "pos_old": store.pos_old,
+        "acceleration": store.acceleration,
+        "radius": store.radius,
+        "tag": store.tag,
+        "link_a": links.a,
+        "link_b": links.b,
+        "link_target": links.target,
+        "container_position": np.asarray(solver.container.position, dtype=np.float64),
+        "container_scale": np.float64(solver.container.scale),
+        "time_step": np.float64(Solver.time_step),
+        "sub_steps": np.int64(Solver.sub_steps),
+        "gravity": np.asarray(Solver.gravity, dtype=np.float64),
+        "friction": np.float64(Solver.friction),
+        "grid_size": np.int64(Solver.grid_size),
+        "jacobi_iterations": np.int64(Solver.jacobi_iterations),
+        "jacobi_relaxation": np.float64(Solver.jacobi_relaxation),
+        "broadphase": np.str_(solver.broadphase),
+        "skin": np.float64(solver.skin),
+        "collision_mode": np.str_(solver.collision_mode),
+        "backend": np.str_(solver.backend),
+    }
+    if schedule is not None:
+        arrays["schedule"] = np.str_(json.dumps(schedule.state()))
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, solver=None, schedule=None):
+    # Restores a checkpoint into solver, or a new headless one, and returns it. The Solver class
+    # settings (time_step, sub_steps, gravity, ...) are global and overwritten as well.
+    with np.load(path, allow_pickle=False) as data:
+        if int(data["version"]) != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {int(data['version'])} in {path}")
+        Solver.time_step = float(data["time_step"])
+        Solver.sub_steps = int(data["sub_steps"])
+        Solver.gravity = data["gravity"].copy()
+        Solver.friction = float(data["friction"])
+        Solver.grid_size = int(data["grid_size"])
+        if "jacobi_iterations" in data:
+            Solver.jacobi_iterations = int(data["jacobi_iterations"])
+            Solver.jacobi_relaxation = float(data["jacobi_relaxation"])
+
+        if solver is None:
+            solver = Solver(Container(data["container_position"], float(data["container_scale"])),
+                            backend=str(data["backend"]))
+        else:
+            solver.container.position = data["container_position"]
+            solver.container.scale = float(data["container_scale"])
+            solver.backend = str(data["backend"])
+        solver.broadphase = str(data["broadphase"])
+        solver.skin = float(data["skin"])
+        solver.collision_mode = str(data["collision_mode"])
+
+        solver.clear()
+        solver.add_objects(data["pos_curr"], data["radius"], data["tag"])
+        solver.store.pos_old[:] = data["pos_old"]
+        solver.store.acceleration[:] = data["acceleration"]
+        solver.links.add_many(data["link_a"], data["link_b"], data["link_target"])
+
+        if schedule is not None and "schedule" in data:
+            schedule.set_state(json.loads(str(data["schedule"])))
+    return solver
+
+
+# Appends the particle positions of every record() call to a trajectory file. Frames are buffered
+# and written a chunk at a time. Particles added between frames join the current chunk, a new chunk
+# starts when particles are removed or the link count changes. Radii and links are stored once per
+# chunk. Call close() (or flush()) when done.
+class TrajectoryRecorder:
+
+    def __init__(self, path, dtype=np.uint16, chunk_frames=256, frame_dt=None):
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.uint16, np.float32):
+            raise ValueError(f"Unsupported trajectory dtype: {self.dtype}")
+        self.chunk_frames = chunk_frames
+        self.frame_dt = Solver.time_step if frame_dt is None else frame_dt
+        self.frames = 0  # Written and buffered
+        self.buffer = None
+        self.buffered = 0
+        self.count = 0  # Particles in the current chunk
+        self.counts = np.empty(chunk_frames, dtype=np.uint32)
+        self.radius = None
+        self.link_a = None
+        self.link_b = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.dtype.itemsize, self.frame_dt).ljust(HEADER_SIZE, b"\0"))
+
+    def record(self, solver):
+        store = solver.store
+        links = solver.links
+        if self.buffer is not None and (store.count < self.count or len(links) != len(self.link_a)):
+            self.flush()
+        if self.buffer is None:
+            self.buffer = np.empty((self.chunk_frames, store.count, 3), dtype=np.float32)
+            self.count = 0
+            self.radius = np.empty(0, dtype=np.float32)
+            self.link_a = links.a.astype(np.int32)
+            self.link_b = links.b.astype(np.int32)
+        if store.count > self.count:
+            self.add_particles(store)
+        self.buffer[self.buffered, :store.count] = store.pos_curr
+        self.counts[self.buffered] = store.count
+        self.buffered += 1
+        self.frames += 1
+        if self.buffered == self.chunk_frames:
+            self.flush()
+
+    def add_particles(self, store):
+        # New particles join the current chunk, sitting at their first position in earlier frames
+        count = store.count
+        if count > self.buffer.shape[1]:
+            buffer = np.empty((self.chunk_frames, max(count, 2 * self.buffer.shape[1]), 3), dtype=np.float32)
+            buffer[:self.buffered, :self.count] = self.buffer[:self.buffered, :self.count]
+            self.buffer = buffer
+        self.buffer[:self.buffered, self.count:count] = store.pos_curr[self.count:]
+        self.radius = np.concatenate((self.radius, store.radius[self.count:].astype(np.float32)))
+        self.count = count
+
+    def flush(self):
+        if self.buffer is None:
+            return
+        positions = self.buffer[:self.buffered, :self.count]
+        offset, scale = np.zeros(3), np.ones(3)
+        if self.dtype == np.uint16:
+            if positions.size:
+                lower = positions.min(axis=(0, 1)).astype(np.float64)
+                upper = positions.max(axis=(0, 1)).astype(np.float64)
+                offset = (lower + upper) / 2
+                scale = np.where(upper > lower, (upper - lower) / 2, 1.0)
+            positions = np.rint((positions - (offset - scale)) * (UINT16_STEPS / (2 * scale)))
+        self.file.write(CHUNK.pack(self.buffered, self.count, len(self.link_a), *offset, *scale))
+        self.file.write(self.counts[:self.buffered].tobytes())
+        self.file.write(self.radius.tobytes())
+        self.file.write(self.link_a.tobytes())
+        self.file.write(self.link_b.tobytes())
+        self.file.write(positions.astype(self.dtype).tobytes())
+        self.file.flush()
+        self.buffer = None
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrajectoryChunk:
+
+    def __init__(self, first, counts, offset, scale, radius, link_a, link_b, positions):
+        self.first = first  # Index of the chunk's first frame in the trajectory
+        self.frames = len(counts)
+        self.count = len(radius)  # Particles in the chunk's last frame
+        self.counts = counts  # Particles in each frame
+        self.radius = radius
+        self.link_a = link_a
+        self.link_b = link_b
+        self.positions = positions  # Memory-mapped, still quantized
+        self.quantized = positions.dtype == np.uint16
+        scale = np.array(scale)
+        self.lower = np.array(offset) - scale
+        self.step = 2 * scale / UINT16_STEPS
+
+    def frame(self, index, out=None):
+        # Positions of the chunk's index-th frame as float64, or of its first len(out) particles
+        if out is None:
+            out = np.empty((self.counts[index], 3))
+        out[:] = self.positions[index, :len(out)]
+        if self.quantized:
+            out *= self.step
+            out += self.lower
+        return out
+
+
+# Memory-mapped view of a trajectory file. A chunk cut short by an interrupted recording is ignored.
+class Trajectory:
+
+    def __init__(self, path):
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            magic, version, itemsize, self.frame_dt = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} trajectory")
+            dtype = np.dtype(np.uint16 if itemsize == 2 else np.float32)
+
+            self.chunks = []
+            frame = 0
+            position = HEADER_SIZE
+            while position + CHUNK.size <= size:
+                f.seek(position)
+                frames, count, links, *bounds = CHUNK.unpack(f.read(CHUNK.size))
+                positions_at = position + CHUNK.size + 4 * frames + 4 * count + 8 * links
+                end = positions_at + frames * count * 3 * itemsize
+                if end > size:
+                    break
+                counts = np.frombuffer(f.read(4 * frames), dtype=np.uint32)
+                radius = np.frombuffer(f.read(4 * count), dtype=np.float32)
+                link_a = np.frombuffer(f.read(4 * links), dtype=np.int32)
+                link_b = np.frombuffer(f.read(4 * links), dtype=np.int32)
+                if count:
+                    positions = np.memmap(path, dtype=dtype, mode="r", offset=positions_at, shape=(frames, count, 3))
+                else:
+                    positions = np.zeros((frames, 0, 3), dtype=dtype)
+                self.chunks.append(TrajectoryChunk(frame, counts, bounds[:3], bounds[3:], radius, link_a, link_b,
+                                                   positions))
+                frame += frames
+                position = end
+        self.frame_count = frame
+        self.starts = np.array([chunk.first for chunk in self.chunks], dtype=np.int64)
+
+    def __len__(self):
+        return self.frame_count
+
+    def chunk(self, index):
+        # The chunk holding frame index
+        return self.chunks[int(np.searchsorted(self.starts, index, side="right")) - 1]
+
+    def frame(self, index):
+        chunk = self.chunk(index)
+        return chunk.frame(index - chunk.first)
+
+
+# Drop-in for simulate.FixedTimestep that shows a recorded Trajectory instead of stepping the
+# solver. The solver only serves as the container of what is drawn: every frame its store holds the
+# current recorded frame, and positions() blends towards the next one for smooth playback at any
+# frame rate. Loops at the end unless loop is False.
+class Playback:
+
+    def __init__(self, solver, trajectory, time_scale=0.09, loop=True):
+        if len(trajectory) == 0:
+            raise ValueError("Trajectory has no frames")
+        self.solver = solver
+        self.trajectory = trajectory
+        self.time_scale = time_scale
+        self.loop = loop
+        self.time = 0.0  # Simulated seconds since the first frame
+        self.index = None
+        self.chunk = None
+        self.fraction = 0.0
+        self.steps = 0
+        self.next_frame = np.empty((0, 3))
+        self.interpolated = np.empty((0, 3))
+        self.solver.clear()
+
+    def advance(self, real_dt):
+        # Returns the number of recorded frames moved forward
+        self.time += real_dt * self.time_scale
+        frame_count = len(self.trajectory)
+        position = self.time / self.trajectory.frame_dt
+        if self.loop:
+            position %= frame_count
+        else:
+            position = min(position, frame_count - 1)
+        index = int(position)
+        self.fraction = position - index
+        steps = 0 if self.index is None else (index - self.index) % frame_count
+        if index != self.index:
+            self.show(index)
+        self.steps += steps
+        return steps
+
+    @property
+    def alpha(self):
+        return self.fraction
+
+    def show(self, index):
+        chunk = self.trajectory.chunk(index)
+        if chunk is not self.chunk:
+            self.load_chunk(chunk)
+        store = self.solver.store
+        # load_chunk filled the rows of every particle in the chunk, later ones are hidden until they appear
+        store.count = int(chunk.counts[index - chunk.first])
+        chunk.frame(index - chunk.first, out=store.pos_curr)
+        self.index = index
+
+    def load_chunk(self, chunk):
+        solver = self.solver
+        store = solver.store
+        links = solver.links
+        if not (np.array_equal(links.a, chunk.link_a) and np.array_equal(links.b, chunk.link_b)):
+            # Only drawn, never solved, so the targets do not matter
+            links = LinkStore()
+            links.add_many(chunk.link_a, chunk.link_b, 0.0)
+        if len(solver.verlet_objects) != chunk.count:
+            solver.clear()
+            solver.add_objects(np.zeros((chunk.count, 3)), chunk.radius)
+        else:
+            store.count = chunk.count
+            store.radius[:] = chunk.radius
+        solver.links = links  # Kept across chunks while unchanged, coloring is not free
+        self.chunk = chunk
+        if len(self.next_frame) < chunk.count:
+            self.next_frame = np.empty((chunk.count, 3))
+            self.interpolated = np.empty((chunk.count, 3))
+
+    def positions(self):
+        # Current frame blended towards the next one, when the next one still has all its particles
+        store = self.solver.store
+        after = self.index + 1
+        if self.fraction == 0 or after >= len(self.trajectory):
+            return store.pos_curr
+        chunk = self.trajectory.chunk(after)
+        if chunk.counts[after - chunk.first] < store.count:
+            return store.pos_curr
+        blend = chunk.frame(after - chunk.first, out=self.next_frame[:store.count])
+        out = self.interpolated[:store.count]
+        np.subtract(blend, store.pos_curr, out=out)
+        out *= self.fraction
+        out += store.pos_curr
+        return out
@@ -0,0 +1,84 @@
+from collections import Counter
+
+from OpenGL.GL import (glUseProgram, glBindVertexArray, glActiveTexture, glBindTexture, glEnable,
+                       glDisable, GL_TEXTURE0)
+
+
+# Shadow copy of the GL binding state. Binds that would not change anything are skipped, so callers
+# can bind what they need before every draw without unbinding afterwards. Every program, VAO,
+# texture and capability change has to go through here (or be followed by invalidate()), otherwise
+# the shadow state goes stale.
+class RenderState:
+
+    def __init__(self):
+        self.issued = Counter()
+        self.skipped = Counter()
+        self.invalidate()
+
+    def invalidate(self):
+        # Forget everything, the next bind of each kind is always issued
+        self.program = None
+        self.vertex_array = None
+        self.active_texture = None
+        self.textures = {}
+        self.caps = {}
+
+    def count(self, name, changed):
+        if changed:
+            self.issued[name] += 1
+        else:
+            self.skipped[name] += 1
+        return changed
+
+    def use_program(self, program):
+        if self.count("glUseProgram", self.program != program):
+            glUseProgram(program)
+            self.program = program
+
+    def bind_vertex_array(self, vao):
+        if self.count("glBindVertexArray", self.vertex_array != vao):
+            glBindVertexArray(vao)
+            self.vertex_array = vao
+
+    def bind_texture(self, unit, target, texture):
+        if not self.count("glBindTexture", self.textures.get((unit, target)) != texture):
+            return
+        if self.count("glActiveTexture", self.active_texture != unit):
+            glActiveTexture(GL_TEXTURE0 + unit)
+            self.active_texture = unit
+        glBindTexture(target, texture)
+        self.textures[(unit, target)] = texture
+
+    def enable(self, cap):
+        if self.count("glEnable", self.caps.get(cap) is not True):
+            glEnable(cap)
+            self.caps[cap] = True
+
+    def disable(self, cap):
+        if self.count("glDisable", self.caps.get(cap) is not False):
+            glDisable(cap)
+            self.caps[cap] = False
+
+    # Deleted objects may be recycled by the driver, so drop any binding that refers to them
+    def forget_program(self, program):
+        if self.program == program:
+            self.program = None
+
+    def forget_vertex_array(self, vao):
+        if self.vertex_array == vao:
+            self.vertex_array = None
+
+    def forget_texture(self, texture):
+        self.textures = {key: bound for key, bound in self.textures.items() if bound != texture}
+
+    def stats(self):
+        names = sorted(set(self.issued) | set(self.skipped))
+        return {name: {"issued": self.issued[name], "skipped": self.skipped[name]} for name in names}
+
+    def reset_stats(self):
+        self.issued.clear()
+        self.skipped.clear()
+
+
+# Shared instance for the one GL context the app uses
+render_state = RenderState()
@@ -0,0 +1,36 @@
+import numpy as np
+
+# Bulk scene builders on top of Solver.add_objects and Solver.link_neighbors. Neighbors come from a
+# KD tree query, so building is O(N log N) instead of sorting every particle's distances.
+
+LINK_SLACK = 1.001  # Link reach is scaled by this so float round-off does not drop exact neighbors
+
+
+def lattice_positions(counts, spacing, origin=(0, 0, 0)):
+    # Points of a regular grid with counts[k] points along axis k (1 for a flat axis), x varying slowest
+    axes = [origin[k] + spacing * np.arange(counts[k]) for k in range(3)]
+    return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+
+
+def lattice(solver, counts, spacing, radius, origin=(0, 0, 0), tag=0, reach=0):
+    # Grid of particles, each linked to the others within reach spacings (0: no links, 1: along the
+    # axes, sqrt(2): plus face diagonals). Returns the particle indices shaped like counts.
+    indices = solver.add_objects(lattice_positions(counts, spacing, origin), radius, tag)
+    if reach > 0:
+        solver.link_neighbors(indices, reach * spacing * LINK_SLACK)
+    return indices.reshape(counts)
+
+
+def cloth(solver, rows, columns, spacing, radius, origin=(0, 0, 0), pinned="corners", shear=False):
+    # Horizontal sheet in the xz plane starting at origin, linked along rows and columns and, with
+    # shear, across the diagonals too. pinned: "corners" | "edge" (the first row) | None.
+    # Returns the particle indices as a (rows, columns) array.
+    indices = lattice(solver, (rows, 1, columns), spacing, radius, origin,
+                      reach=np.sqrt(2) if shear else 1).reshape(rows, columns)
+    if pinned == "corners":
+        solver.store.tag[indices[[0, 0, -1, -1], [0, -1, 0, -1]]] = 1
+    elif pinned == "edge":
+        solver.store.tag[indices[0]] = 1
+    elif pinned is not None:
+        raise ValueError(f"Unknown pinning: {pinned}")
+    return indices
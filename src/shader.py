@@ -1,35 +1,165 @@
-from OpenGL.GL.shaders import compileProgram, compileShader
-from OpenGL.raw.GL.VERSION.GL_2_0 import GL_VERTEX_SHADER, GL_FRAGMENT_SHADER, glUseProgram, glDeleteProgram
+import hashlib
+import os
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL.shaders import compileShader, ShaderLinkError
+
+from src import shader_cache
+from src.render_state import render_state
+
+# Upload function and component count per active uniform type
+UNIFORM_SETTERS = {
+    GL_FLOAT: (glUniform1fv, 1),
+    GL_FLOAT_VEC2: (glUniform2fv, 2),
+    GL_FLOAT_VEC3: (glUniform3fv, 3),
+    GL_FLOAT_VEC4: (glUniform4fv, 4),
+    GL_INT: (glUniform1iv, 1),
+    GL_INT_VEC2: (glUniform2iv, 2),
+    GL_INT_VEC3: (glUniform3iv, 3),
+    GL_INT_VEC4: (glUniform4iv, 4),
+    GL_BOOL: (glUniform1iv, 1),
+    GL_SAMPLER_2D: (glUniform1iv, 1),
+    GL_SAMPLER_CUBE: (glUniform1iv, 1),
+    GL_FLOAT_MAT3: (lambda location, count, value: glUniformMatrix3fv(location, count, GL_FALSE, value), 9),
+    GL_FLOAT_MAT4: (lambda location, count, value: glUniformMatrix4fv(location, count, GL_FALSE, value), 16),
+}
+INT_TYPES = {GL_INT, GL_INT_VEC2, GL_INT_VEC3, GL_INT_VEC4, GL_BOOL, GL_SAMPLER_2D, GL_SAMPLER_CUBE}
+
+
+class Uniform:
+    __slots__ = ("name", "location", "type", "size")
+
+    def __init__(self, name, location, gl_type, size):
+        self.name = name
+        self.location = location
+        self.type = gl_type
+        self.size = size
+
+
+# One linked program plus what is known about it. Shaders built from identical sources share a
+# Program, it is deleted when the last of them is destroyed.
+class Program:
+
+    def __init__(self, program_id):
+        self.id = program_id
+        self.refs = 0
+        self.uniforms = self.introspect()
+        self.values = {}  # Last value uploaded per uniform name
+
+    def introspect(self):
+        # Active uniforms by name, arrays are also reachable without the "[0]" suffix. Uniforms in
+        # blocks (e.g. CameraBlock) have no location and are left out.
+        uniforms = {}
+        for index in range(glGetProgramiv(self.id, GL_ACTIVE_UNIFORMS)):
+            name, size, gl_type = glGetActiveUniform(self.id, index)
+            name = name.decode() if isinstance(name, bytes) else name
+            location = glGetUniformLocation(self.id, name)
+            if location < 0:
+                continue
+            uniform = Uniform(name, location, gl_type, size)
+            uniforms[name] = uniform
+            if name.endswith("[0]"):
+                uniforms[name[:-3]] = uniform
+        return uniforms
 
 
 class Shader:
+    programs = {}  # Source digest -> Program
+    use_binary_cache = True
+    cache_dir = None  # Program binaries go to <vertex shader dir>/.cache when None
 
     def __init__(self, vertex_filepath, fragment_filepath):
-        self.in_use = False
-        self.shader_id = self.create_shader(vertex_filepath, fragment_filepath)
-
-    def create_shader(self, vertex_filepath, fragment_filepath):
         with open(vertex_filepath, 'r') as f:
-            vertex_src = f.readlines()
-
+            vertex_src = f.read()
         with open(fragment_filepath, 'r') as f:
-            fragment_src = f.readlines()
+            fragment_src = f.read()
+
+        key = hashlib.sha256(vertex_src.encode() + b"\0" + fragment_src.encode()).hexdigest()
+        program = Shader.programs.get(key)
+        if program is None:
+            cache_dir = Shader.cache_dir
+            if cache_dir is None:
+                cache_dir = os.path.join(os.path.dirname(vertex_filepath), ".cache")
+            program = Program(self.create_shader(vertex_src, fragment_src, cache_dir))
+            Shader.programs[key] = program
+        program.refs += 1
+        self.key = key
+        self.program = program
+        self.shader_id = program.id
+        self.uniforms = program.uniforms
 
-        shader = compileProgram(
-            compileShader(vertex_src, GL_VERTEX_SHADER),
-            compileShader(fragment_src, GL_FRAGMENT_SHADER)
-        )
+    def create_shader(self, vertex_src, fragment_src, cache_dir):
+        use_binary = Shader.use_binary_cache and shader_cache.binary_supported()
+        path = None
+        if use_binary:
+            path = shader_cache.cache_path(cache_dir, shader_cache.program_key(vertex_src, fragment_src))
+            shader = glCreateProgram()
+            if shader_cache.load_binary(path, shader):
+                return shader
+            glDeleteProgram(shader)
 
+        vertex = compileShader(vertex_src, GL_VERTEX_SHADER)
+        fragment = compileShader(fragment_src, GL_FRAGMENT_SHADER)
+        shader = glCreateProgram()
+        glAttachShader(shader, vertex)
+        glAttachShader(shader, fragment)
+        if use_binary:
+            glProgramParameteri(shader, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        glLinkProgram(shader)
+        glDetachShader(shader, vertex)
+        glDetachShader(shader, fragment)
+        glDeleteShader(vertex)
+        glDeleteShader(fragment)
+        if glGetProgramiv(shader, GL_LINK_STATUS) != GL_TRUE:
+            log = glGetProgramInfoLog(shader)
+            glDeleteProgram(shader)
+            raise ShaderLinkError(log)
+
+        if use_binary:
+            try:
+                shader_cache.save_binary(path, shader)
+            except (OSError, GLError):
+                pass  # Read-only shader directory, compile again next launch
         return shader
 
+    def location(self, name):
+        # -1 for uniforms that are not active, which glUniform* ignores
+        uniform = self.uniforms.get(name)
+        return -1 if uniform is None else uniform.location
+
+    def set_uniform(self, name, value):
+        # Uploads value to the named uniform with the setter matching its declared type. Skipped when
+        # the uniform is not active or already holds value, returns whether anything was uploaded.
+        # Values are tracked per program, so uniforms set with glUniform* directly are not seen here.
+        uniform = self.uniforms.get(name)
+        if uniform is None:
+            return False
+        setter, components = UNIFORM_SETTERS[uniform.type]
+        dtype = np.int32 if uniform.type in INT_TYPES else np.float32
+        value = np.ascontiguousarray(value, dtype=dtype).reshape(-1)
+        last = self.program.values.get(name)
+        if last is not None and np.array_equal(last, value):
+            return False
+        self.use()
+        setter(uniform.location, len(value) // components, value)
+        self.program.values[name] = value.copy()
+        return True
+
+    @property
+    def in_use(self):
+        return render_state.program == self.shader_id
+
     def use(self):
-        if not self.in_use:
-            glUseProgram(self.shader_id)
-            self.in_use = True
+        render_state.use_program(self.shader_id)
 
     def detach(self):
-        glUseProgram(0)
-        self.in_use = False
+        render_state.use_program(0)
 
     def destroy(self):
+        self.program.refs -= 1
+        if self.program.refs > 0:
+            return
+        Shader.programs.pop(self.key, None)
+        render_state.forget_program(self.shader_id)
         glDeleteProgram(self.shader_id)
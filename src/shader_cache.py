@@ -0,0 +1,81 @@
+import hashlib
+import os
+import struct
+
+import numpy as np
+from OpenGL.GL import (glGetString, glGetIntegerv, glGetProgramiv, glGetProgramBinary, glProgramBinary,
+                       GL_VENDOR, GL_RENDERER, GL_VERSION, GL_NUM_PROGRAM_BINARY_FORMATS,
+                       GL_PROGRAM_BINARY_LENGTH, GL_LINK_STATUS, GLenum, GLsizei)
+from OpenGL.GL.ARB.get_program_binary import glInitGetProgramBinaryARB
+from OpenGL.error import GLError, NullFunctionError
+
+# File layout: HEADER, then length bytes of driver specific program binary in the given format.
+# The file name already encodes the sources and the driver, the header only guards against
+# truncated or foreign files.
+MAGIC = b"VPRG"
+VERSION = 1
+HEADER = struct.Struct("<4sIIQ")
+EXTENSION = ".programbinary"
+
+supported = None  # Filled on first use, needs a current context
+
+
+def binary_supported():
+    global supported
+    if supported is None:
+        try:
+            supported = bool(glInitGetProgramBinaryARB()) and glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+        except (GLError, NullFunctionError):
+            supported = False
+    return supported
+
+
+def driver_string():
+    return b"|".join(glGetString(name) or b"" for name in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+
+
+def program_key(vertex_src, fragment_src):
+    # Binaries are only valid for the driver that produced them, so the driver is part of the key
+    digest = hashlib.sha256()
+    for part in (vertex_src.encode(), fragment_src.encode(), driver_string()):
+        digest.update(struct.pack("<Q", len(part)))
+        digest.update(part)
+    return digest.hexdigest()[:24]
+
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key + EXTENSION)
+
+
+def load_binary(path, program):
+    # Loads a cached binary into program, returns whether it linked
+    try:
+        with open(path, "rb") as f:
+            magic, version, binary_format, length = HEADER.unpack(f.read(HEADER.size))
+            binary = np.frombuffer(f.read(), dtype=np.uint8)
+    except (OSError, struct.error):
+        return False
+    if magic != MAGIC or version != VERSION or len(binary) != length:
+        return False
+    try:
+        glProgramBinary(program, binary_format, binary, length)
+    except GLError:
+        return False  # Format no longer accepted, e.g. after a driver update with the same strings
+    return glGetProgramiv(program, GL_LINK_STATUS) == 1
+
+
+def save_binary(path, program):
+    length = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+    if length <= 0:
+        return
+    binary = np.empty(length, dtype=np.uint8)
+    written = GLsizei()
+    binary_format = GLenum()
+    glGetProgramBinary(program, length, written, binary_format, binary)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, binary_format.value, written.value))
+        f.write(binary[:written.value].tobytes())
+    os.replace(tmp_path, path)
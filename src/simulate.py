@@ -0,0 +1,189 @@
+import argparse
+import time
+
+import numpy as np
+
+from src.parallel import ParallelSolver
+from src.profiler import profiler
+from src.recording import TrajectoryRecorder, load_checkpoint, save_checkpoint
+from src.scenes import cloth
+from src.verlet import Container, Solver
+
+
+# Drops balls on a ring above the container, one batch every `interval` steps until `max_balls`
+class SpawnSchedule:
+
+    def __init__(self, max_balls=350, interval=1, per_spawn=1, radius=0.2, height=3, ring_radius=2, seed=None):
+        self.max_balls = max_balls
+        self.interval = interval
+        self.per_spawn = per_spawn
+        self.radius = radius
+        self.height = height
+        self.ring_radius = ring_radius
+        self.rng = np.random.default_rng(seed)
+        self.num_steps = 0
+        self.num_balls = 0
+
+    def step(self, solver):
+        self.num_steps += 1
+        if self.num_steps < self.interval or self.num_balls >= self.max_balls:
+            return
+        self.num_steps = 0
+        count = min(self.per_spawn, self.max_balls - self.num_balls)
+        angles = np.deg2rad(360 * self.rng.random((count, 2)))
+        positions = np.column_stack((np.cos(angles[:, 0]) * self.ring_radius, np.full(count, self.height),
+                                     np.sin(angles[:, 1]) * self.ring_radius))
+        solver.add_objects(positions, self.radius)
+        self.num_balls += count
+
+    def state(self):
+        # Progress through the schedule, JSON safe, see recording.save_checkpoint
+        return {"num_steps": self.num_steps, "num_balls": self.num_balls, "rng": self.rng.bit_generator.state}
+
+    def set_state(self, state):
+        self.num_steps = state["num_steps"]
+        self.num_balls = state["num_balls"]
+        self.rng.bit_generator.state = state["rng"]
+
+
+# Runs as many fixed Solver.time_step steps as real time calls for. Real seconds are scaled to
+# simulated ones by time_scale, the default keeps the old pace of one step per frame at 60 fps. At
+# most max_steps run per advance(), time beyond that is dropped so a slow frame cannot snowball
+# into ever longer ones. The leftover fraction of a step is exposed as alpha for interpolation.
+class FixedTimestep:
+
+    def __init__(self, solver, schedule=None, time_scale=0.09, max_steps=4):
+        self.solver = solver
+        self.schedule = schedule
+        self.time_scale = time_scale
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.steps = 0
+        self.dropped = 0.0  # Simulated seconds skipped by the clamp
+        self.interpolated = np.empty((0, 3))
+
+    def advance(self, real_dt):
+        # Returns the number of solver steps taken
+        time_step = Solver.time_step
+        # Rounding slack, so a frame time that maps to exactly one step never alternates 0 and 2
+        due = time_step * (1 - 1e-9)
+        self.accumulator += real_dt * self.time_scale
+        steps = 0
+        while self.accumulator >= due and steps < self.max_steps:
+            if self.schedule is not None:
+                self.schedule.step(self.solver)
+            self.solver.update()
+            self.accumulator -= time_step
+            steps += 1
+        if self.accumulator >= due:
+            backlog = self.accumulator - self.accumulator % time_step
+            self.dropped += backlog
+            self.accumulator -= backlog
+        self.steps += steps
+        return steps
+
+    @property
+    def alpha(self):
+        # How far real time is into the next step, 0..1
+        return min(max(self.accumulator / Solver.time_step, 0.0), 1.0)
+
+    def positions(self):
+        # Positions blended between the last two steps by alpha, for rendering. Pinned objects are
+        # not integrated, their pos_old is stale, so they are drawn where they are.
+        store = self.solver.store
+        if len(self.interpolated) < store.count:
+            self.interpolated = np.empty((max(store.count, 2 * len(self.interpolated)), 3))
+        out = self.interpolated[:store.count]
+        np.subtract(store.pos_curr, store.pos_old, out=out)
+        out *= self.alpha
+        out += store.pos_old
+        pinned = store.tag == 1
+        out[pinned] = store.pos_curr[pinned]
+        return out
+
+
+def run(solver, schedule, steps, recorder=None):
+    start = time.perf_counter()
+    for _ in range(steps):
+        schedule.step(solver)
+        solver.update()
+        if recorder is not None:
+            recorder.record(solver)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Verlet solver without a window")
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--max-balls", type=int, default=350)
+    parser.add_argument("--spawn-interval", type=int, default=1, help="steps between spawns")
+    parser.add_argument("--per-spawn", type=int, default=1, help="balls added per spawn")
+    parser.add_argument("--radius", type=float, default=0.2)
+    parser.add_argument("--container-scale", type=float, default=4)
+    parser.add_argument("--cloth", type=int, default=0,
+                        help="hang an N x N cloth pinned at its corners in the container")
+    parser.add_argument("--sub-steps", type=int, default=Solver.sub_steps, help="solver sub-steps per step")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--backend", choices=("numpy", "numba"), default=Solver.backend)
+    parser.add_argument("--broadphase", choices=("kd", "grid"), default=Solver.broadphase)
+    parser.add_argument("--collision-mode", choices=("jacobi", "gauss_seidel"), default=Solver.collision_mode)
+    parser.add_argument("--skin", type=float, default=Solver.skin,
+                        help="kd neighbor list skin in max radii, 0 rebuilds the pairs every substep")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="step slabs of the container in this many processes (0: serial Solver)")
+    parser.add_argument("--resume", metavar="PATH",
+                        help="continue from a checkpoint, its solver settings replace the ones given here")
+    parser.add_argument("--checkpoint", metavar="PATH", help="save a .npz checkpoint of the final state")
+    parser.add_argument("--record", metavar="PATH", help="append every step's positions to a trajectory file")
+    parser.add_argument("--record-dtype", choices=("uint16", "float32"), default="uint16",
+                        help="uint16 stores positions as fixed point over each chunk's bounds, half the size")
+    parser.add_argument("--profile", action="store_true", help="print per-pass solver timings")
+    parser.add_argument("--trace", help="write a Chrome trace JSON to this path")
+    args = parser.parse_args()
+
+    profiler.enabled = args.profile or args.trace is not None
+    profiler.trace = args.trace is not None
+    Solver.sub_steps = args.sub_steps
+    Solver.skin = args.skin
+
+    if args.workers:
+        solver = ParallelSolver(Container(scale=args.container_scale), backend=args.backend, workers=args.workers)
+    else:
+        solver = Solver(Container(scale=args.container_scale), backend=args.backend)
+    solver.broadphase = args.broadphase
+    solver.collision_mode = args.collision_mode
+    if args.cloth:
+        # Centered on the container, neighboring balls one diameter apart so they just touch
+        spacing = 2 * args.radius
+        half = spacing * (args.cloth - 1) / 2
+        cloth(solver, args.cloth, args.cloth, spacing, args.radius, origin=(-half, 0, -half))
+    schedule = SpawnSchedule(max_balls=args.max_balls, interval=args.spawn_interval, per_spawn=args.per_spawn,
+                             radius=args.radius, seed=args.seed)
+
+    if args.resume is not None:
+        load_checkpoint(args.resume, solver, schedule)
+    recorder = None
+    if args.record is not None:
+        recorder = TrajectoryRecorder(args.record, dtype=args.record_dtype)
+
+    try:
+        elapsed = run(solver, schedule, args.steps, recorder)
+        if args.checkpoint is not None:
+            save_checkpoint(args.checkpoint, solver, schedule)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if args.workers:
+            solver.close()
+    print(f"Steps: {args.steps} | Balls: {solver.store.count} | Time: {elapsed:.3f}s | "
+          f"Steps/s: {args.steps / elapsed:.1f}")
+    if solver.neighbors is not None:
+        print("Neighbor list:", solver.neighbors.stats())
+    if profiler.enabled:
+        print(profiler.summary())
+    if args.trace is not None:
+        profiler.save_trace(args.trace)
+
+
+if __name__ == '__main__':
+    main()
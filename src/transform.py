@@ -0,0 +1,116 @@
+import numpy as np
+
+# Model matrices use pyrr's row-vector layout (scale * rotation * translation, translation in the
+# last row), so they can be passed to glUniformMatrix4fv with GL_FALSE like before.
+
+
+def euler_matrices(eulers):
+    # (..., 3) radians in pyrr's (roll, pitch, yaw) order -> (..., 3, 3), same as
+    # pyrr.matrix33.create_from_eulers
+    eulers = np.asarray(eulers, dtype=np.float64)
+    roll, pitch, yaw = eulers[..., 0], eulers[..., 1], eulers[..., 2]
+    sP, cP = np.sin(pitch), np.cos(pitch)
+    sR, cR = np.sin(roll), np.cos(roll)
+    sY, cY = np.sin(yaw), np.cos(yaw)
+    m = np.empty(eulers.shape[:-1] + (3, 3))
+    m[..., 0, 0] = cY * cP
+    m[..., 0, 1] = -cY * sP * cR + sY * sR
+    m[..., 0, 2] = cY * sP * sR + sY * cR
+    m[..., 1, 0] = sP
+    m[..., 1, 1] = cP * cR
+    m[..., 1, 2] = -cP * sR
+    m[..., 2, 0] = -sY * cP
+    m[..., 2, 1] = sY * sP * cR + cY * sR
+    m[..., 2, 2] = -sY * sP * sR + cY * cR
+    return m
+
+
+def trs_matrix(position, rotation33=None, scale=1, out=None):
+    # Closed form of scale * rotation * translation for one transform
+    if out is None:
+        out = np.empty((4, 4), dtype=np.float32)
+    scale = np.broadcast_to(np.asarray(scale, dtype=np.float64), (3,))
+    if rotation33 is None:
+        out[:3, :3] = np.diag(scale)
+    else:
+        out[:3, :3] = scale[:, None] * rotation33
+    out[:3, 3] = 0
+    out[3, :3] = position
+    out[3, 3] = 1
+    return out
+
+
+def model_matrices(positions, scales=1, rotations=None, out=None):
+    # (M, 4, 4) float32 model matrices from (M, 3) positions, (M,) or (M, 3) scales and optional
+    # (M, 3) euler rotations in radians, built in one pass
+    positions = np.asarray(positions)
+    count = len(positions)
+    if out is None:
+        out = np.empty((count, 4, 4), dtype=np.float32)
+    scales = np.asarray(scales, dtype=np.float64)
+    if scales.ndim < 2:
+        scales = np.broadcast_to(scales.reshape(-1, 1), (count, 3))
+    if rotations is None:
+        out[:, :3, :3] = 0
+        idx = np.arange(3)
+        out[:, idx, idx] = scales
+    else:
+        out[:, :3, :3] = scales[:, :, None] * euler_matrices(rotations)
+    out[:, :3, 3] = 0
+    out[:, 3, :3] = positions
+    out[:, 3, 3] = 1
+    return out
+
+
+# Position, euler rotation (radians) and scale with a cached model matrix. The matrix is rebuilt on
+# the first read after any of them is assigned. The arrays handed out are read-only so that
+# in-place edits cannot bypass the dirty flag, assign a new value instead.
+class Transform:
+
+    def __init__(self, position=(0, 0, 0), rotation=(0, 0, 0), scale=1):
+        self._matrix = np.identity(4, dtype=np.float32)
+        self.dirty = True
+        self.position = position
+        self.rotation = rotation
+        self.scale = scale
+
+    @staticmethod
+    def frozen(value):
+        value = np.array(value, dtype=np.float32)
+        value.flags.writeable = False
+        return value
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, value):
+        self._position = Transform.frozen(value)
+        self.dirty = True
+
+    @property
+    def rotation(self):
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, value):
+        self._rotation = Transform.frozen(value)
+        self.dirty = True
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, value):
+        self._scale = value if np.isscalar(value) else Transform.frozen(value)
+        self.dirty = True
+
+    @property
+    def matrix(self):
+        if self.dirty:
+            rotation33 = euler_matrices(self._rotation) if self._rotation.any() else None
+            trs_matrix(self._position, rotation33, self._scale, out=self._matrix)
+            self.dirty = False
+        return self._matrix
@@ -3,39 +3,281 @@ import math
 import numpy as np
 from scipy.spatial import KDTree
 
+from src import kernels
+from src.broadphase import NeighborList, UniformGrid
+from src.profiler import profiler
 
+
+def row_norms(v):
+    return np.sqrt(np.einsum('ij,ij->i', v, v))
+
+
+class ParticleStore:
+    FIELDS = ("_pos_curr", "_pos_old", "_acceleration", "_radius", "_tag")
+
+    def __init__(self, capacity=64):
+        self.count = 0
+        self._pos_curr = self.allocate((capacity, 3), np.float64)
+        self._pos_old = self.allocate((capacity, 3), np.float64)
+        self._acceleration = self.allocate((capacity, 3), np.float64)
+        self._radius = self.allocate((capacity,), np.float64)
+        self._tag = self.allocate((capacity,), np.int32)
+
+    def allocate(self, shape, dtype):
+        # Zeroed backing array for one field, see parallel.SharedParticleStore
+        return np.zeros(shape, dtype=dtype)
+
+    # Views over the active particles (rows [0, count))
+    @property
+    def pos_curr(self):
+        return self._pos_curr[:self.count]
+
+    @property
+    def pos_old(self):
+        return self._pos_old[:self.count]
+
+    @property
+    def acceleration(self):
+        return self._acceleration[:self.count]
+
+    @property
+    def radius(self):
+        return self._radius[:self.count]
+
+    @property
+    def tag(self):
+        return self._tag[:self.count]
+
+    @property
+    def capacity(self):
+        return len(self._radius)
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity)
+        for name in ParticleStore.FIELDS:
+            old = getattr(self, name)
+            new = self.allocate((capacity,) + old.shape[1:], old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def copy_rows(self, source, rows):
+        # Replaces the contents with the given rows of another store, in order
+        self.count = 0
+        self.reserve(len(rows))
+        for name in ParticleStore.FIELDS:
+            getattr(self, name)[:len(rows)] = getattr(source, name)[rows]
+        self.count = len(rows)
+
+    def add(self, pos_curr, pos_old=None, acceleration=(0.0, 0.0, 0.0), radius=1, tag=0):
+        self.reserve(self.count + 1)
+        i = self.count
+        self._pos_curr[i] = pos_curr
+        self._pos_old[i] = pos_curr if pos_old is None else pos_old
+        self._acceleration[i] = acceleration
+        self._radius[i] = radius
+        self._tag[i] = tag
+        self.count += 1
+        return i
+
+    def add_many(self, pos_curr, radius=1, tag=0):
+        # Appends len(pos_curr) particles at rest, radius and tag are scalars or one per particle.
+        # Returns the new rows.
+        pos_curr = np.asarray(pos_curr, dtype=np.float64).reshape(-1, 3)
+        start, end = self.count, self.count + len(pos_curr)
+        self.reserve(end)
+        self._pos_curr[start:end] = pos_curr
+        self._pos_old[start:end] = pos_curr
+        self._acceleration[start:end] = 0
+        self._radius[start:end] = radius
+        self._tag[start:end] = tag
+        self.count = end
+        return np.arange(start, end)
+
+
+# Handle onto one row of a ParticleStore. A fresh object owns a single-row store,
+# Solver.add_object moves it into the solver's store.
 class VerletObject:
 
     def __init__(self, position=(0.0, 0.0, 0.0), radius=1, tag=0):
-        self.pos_curr = np.array(position, dtype=np.float64)
-        self.pos_old = np.array(position, dtype=np.float64)
-        self.acceleration = np.zeros(3)
-        self.radius = radius
-        self.tag = tag  # 0=Free | 1=Rigid
-
-
-class Link:
-
-    def __init__(self, a, b, target):
-        self.a = a
-        self.b = b
-        self.target = target
-
-    def apply(self):
-        disp = self.a.pos_curr - self.b.pos_curr
-        dist = np.sqrt(disp.dot(disp))
-        if dist != 0:
-            n = disp / dist
-            delta = self.target - dist
-            percent = 0.5
-            if self.a.tag == 1:
-                percent = 0
-            elif self.b.tag == 1:
-                percent = 1
-            if self.b.tag == 1 and self.a.tag == 1:
-                return
-            self.a.pos_curr += percent * delta * n
-            self.b.pos_curr -= (1 - percent) * delta * n
+        self.store = ParticleStore(capacity=1)
+        self.index = self.store.add(position, radius=radius, tag=tag)  # tag: 0=Free | 1=Rigid
+
+    @classmethod
+    def view(cls, store, index):
+        # Handle onto a row that is already in store, see Solver.add_objects
+        obj = cls.__new__(cls)
+        obj.store = store
+        obj.index = index
+        return obj
+
+    def bind(self, store):
+        self.index = store.add(self.pos_curr, self.pos_old, self.acceleration, self.radius, self.tag)
+        self.store = store
+
+    @property
+    def pos_curr(self):
+        return self.store.pos_curr[self.index]
+
+    @pos_curr.setter
+    def pos_curr(self, value):
+        self.store.pos_curr[self.index] = value
+
+    @property
+    def pos_old(self):
+        return self.store.pos_old[self.index]
+
+    @pos_old.setter
+    def pos_old(self, value):
+        self.store.pos_old[self.index] = value
+
+    @property
+    def acceleration(self):
+        return self.store.acceleration[self.index]
+
+    @acceleration.setter
+    def acceleration(self, value):
+        self.store.acceleration[self.index] = value
+
+    @property
+    def radius(self):
+        return self.store.radius[self.index]
+
+    @radius.setter
+    def radius(self, value):
+        self.store.radius[self.index] = value
+
+    @property
+    def tag(self):
+        return self.store.tag[self.index]
+
+    @tag.setter
+    def tag(self, value):
+        self.store.tag[self.index] = value
+
+
+# Distance constraints as endpoint index arrays into a ParticleStore. Every link gets a color on
+# insert, the lowest one not yet used at either endpoint, so links of one color share no particle
+# and each color can be projected as a single vectorized batch without write conflicts.
+class LinkStore:
+    FIELDS = ("_a", "_b", "_target", "_color")
+
+    def __init__(self, capacity=64):
+        self.count = 0
+        self._a = np.zeros(capacity, dtype=np.int64)
+        self._b = np.zeros(capacity, dtype=np.int64)
+        self._target = np.zeros(capacity, dtype=np.float64)
+        self._color = np.zeros(capacity, dtype=np.int64)
+        self.keys = set()  # (min index, max index) of every link, for O(1) duplicate checks
+        self.node_colors = {}  # Particle index -> bitmask of the colors of its links
+        self.batch_cache = None
+
+    @property
+    def a(self):
+        return self._a[:self.count]
+
+    @property
+    def b(self):
+        return self._b[:self.count]
+
+    @property
+    def target(self):
+        return self._target[:self.count]
+
+    @property
+    def color(self):
+        return self._color[:self.count]
+
+    @property
+    def capacity(self):
+        return len(self._a)
+
+    def __len__(self):
+        return self.count
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity)
+        for name in LinkStore.FIELDS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add(self, a, b, target):
+        # Returns the new link's index, or None when a and b are already linked
+        added = self.add_many((a,), (b,), target)
+        return int(added[0]) if len(added) else None
+
+    def add_many(self, a, b, target):
+        # Bulk add(), target is a scalar or one per link. Returns the indices of the links that were
+        # not already present.
+        a = np.asarray(a, dtype=np.int64).ravel()
+        b = np.asarray(b, dtype=np.int64).ravel()
+        target = np.broadcast_to(np.asarray(target, dtype=np.float64), a.shape)
+        keep = np.ones(len(a), dtype=bool)
+        color = np.empty(len(a), dtype=np.int64)
+        keys = self.keys
+        node_colors = self.node_colors
+        for k, (i, j) in enumerate(zip(a.tolist(), b.tolist())):
+            key = (i, j) if i < j else (j, i)
+            if key in keys:
+                keep[k] = False
+                continue
+            keys.add(key)
+            used_i = node_colors.get(i, 0)
+            used_j = node_colors.get(j, 0)
+            used = used_i | used_j
+            c = (~used & (used + 1)).bit_length() - 1
+            node_colors[i] = used_i | 1 << c
+            node_colors[j] = used_j | 1 << c
+            color[k] = c
+
+        start, end = self.count, self.count + int(keep.sum())
+        self.reserve(end)
+        self._a[start:end] = a[keep]
+        self._b[start:end] = b[keep]
+        self._target[start:end] = target[keep]
+        self._color[start:end] = color[keep]
+        self.count = end
+        self.batch_cache = None
+        return np.arange(start, end)
+
+    def batches(self):
+        # Links sorted by color as (a, b, target, offsets), color c spans [offsets[c], offsets[c + 1])
+        if self.batch_cache is None:
+            order = np.argsort(self.color, kind="stable")
+            color = self.color[order]
+            offsets = np.searchsorted(color, np.arange(color[-1] + 2 if self.count else 1))
+            self.batch_cache = (self.a[order], self.b[order], self.target[order], offsets)
+        return self.batch_cache
+
+    def apply(self, pos_curr, tag):
+        a, b, target, offsets = self.batches()
+        # Share of the correction each endpoint takes: rigid ends take none, their partner all of it
+        rigid_a = tag[a] == 1
+        rigid_b = tag[b] == 1
+        weight_a = np.where(rigid_a, 0.0, np.where(rigid_b, 1.0, 0.5))
+        weight_b = np.where(rigid_b, 0.0, np.where(rigid_a, 1.0, 0.5))
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            i, j = a[start:end], b[start:end]
+            disp = pos_curr[i] - pos_curr[j]
+            dist = row_norms(disp)
+            nonzero = dist > 0
+            scale = np.divide(target[start:end] - dist, dist, out=np.zeros_like(dist), where=nonzero)
+            correction = disp * scale[:, None]
+            pos_curr[i] += correction * weight_a[start:end, None]
+            pos_curr[j] -= correction * weight_b[start:end, None]
+
+
+# Stand-in for a Model when only the container bounds matter (headless runs)
+class Container:
+
+    def __init__(self, position=(0, 0, 0), scale=1):
+        self.position = np.array(position, dtype=np.float32)
+        self.scale = scale
 
 
 class Solver:
@@ -47,40 +289,80 @@ class Solver:
 
     friction = -100
 
-    grid_size = 10
+    grid_size = 64  # Max cells per axis of the uniform grid
+
+    broadphase = "kd"  # kd | grid (faster than kd from about 2k particles, see UniformGrid)
+    skin = 0.0  # Neighbor list skin for the kd broadphase, in max radii. 0 rebuilds the pairs every substep
+    collision_mode = "jacobi"  # jacobi | gauss_seidel
+    # Jacobi passes per substep over the same pairs, and the factor on each particle's averaged correction.
+    # With these the settled pile overlaps and jitters about as little as with gauss_seidel, above 2 it diverges.
+    jacobi_iterations = 4
+    jacobi_relaxation = 1.5
+    backend = "numpy"  # numpy | numba (falls back to numpy when numba is not installed)
 
-    def __init__(self, container, verlet_objects=[]):
+    def __init__(self, container, verlet_objects=(), backend=None):
         self.container = container
-        self.verlet_objects = verlet_objects
-        self.links = []
+        if backend is not None:
+            self.backend = backend
+        self.store = ParticleStore()
+        self.verlet_objects = []
+        self.links = LinkStore()
+        self.grid = None
+        self.neighbors = None
+        self.profiler = profiler
+        for obj in verlet_objects:
+            self.add_object(obj)
 
     def update(self):
         sub_dt = Solver.time_step / Solver.sub_steps
         for step in range(Solver.sub_steps):
+            self.step(sub_dt)
+
+    def step(self, dt):
+        with self.profiler.scope("solver.apply_forces"):
             self.apply_forces()
-            # self.brute_collisions()
-            if self.verlet_objects:
-                self.kd_collisions()
+        # self.brute_collisions()
+        if self.store.count:
+            with self.profiler.scope("solver.collisions"):
+                self.collisions()
+        with self.profiler.scope("solver.apply_constraints"):
             self.apply_constraints()
-            self.update_positions(sub_dt)
+        with self.profiler.scope("solver.update_positions"):
+            self.update_positions(dt)
+        with self.profiler.scope("solver.update_links"):
             self.update_links()
 
+    @property
+    def compiled(self):
+        if self.backend not in ("numpy", "numba"):
+            raise ValueError(f"Unknown backend: {self.backend}")
+        return self.backend == "numba" and kernels.NUMBA_AVAILABLE
+
     def update_positions(self, dt):
-        for obj in self.verlet_objects:
-            if obj.tag != 1:
-                displacement = obj.pos_curr - obj.pos_old
-                obj.pos_old = obj.pos_curr
-                obj.pos_curr = obj.pos_curr + displacement + obj.acceleration * dt * dt
-            obj.acceleration = np.zeros(3, dtype=np.float64)
+        if self.compiled:
+            kernels.update_positions(self.store.pos_curr, self.store.pos_old, self.store.acceleration,
+                                     self.store.tag, dt)
+            return
+        pos_curr = self.store.pos_curr
+        pos_old = self.store.pos_old
+        acceleration = self.store.acceleration
+        free = self.store.tag != 1
+        displacement = pos_curr[free] - pos_old[free]
+        pos_old[free] = pos_curr[free]
+        pos_curr[free] += displacement + acceleration[free] * dt * dt
+        acceleration.fill(0)
 
     def apply_forces(self):
-        for obj in self.verlet_objects:
-            obj.acceleration += Solver.gravity
-            disp = obj.pos_curr - obj.pos_old
-            dist = np.sqrt(disp.dot(disp))
-            if dist > 0:
-                n = disp / dist
-                obj.acceleration += n * Solver.friction
+        if self.compiled:
+            kernels.apply_forces(self.store.pos_curr, self.store.pos_old, self.store.acceleration,
+                                 Solver.gravity, float(Solver.friction))
+            return
+        acceleration = self.store.acceleration
+        acceleration += Solver.gravity
+        disp = self.store.pos_curr - self.store.pos_old
+        dist = row_norms(disp)
+        moving = dist > 0
+        acceleration[moving] += disp[moving] / dist[moving, None] * Solver.friction
 
     def handle_collision(self, a, b):
         axis = a.pos_curr - b.pos_curr
@@ -98,12 +380,99 @@ class Solver:
             for b in self.verlet_objects:
                 self.handle_collision(a, b)
 
+    def collisions(self):
+        if self.broadphase == "kd":
+            if self.skin > 0:
+                self.neighbor_collisions()
+            else:
+                self.kd_collisions()
+        elif self.broadphase == "grid":
+            self.grid_collisions()
+        else:
+            raise ValueError(f"Unknown broadphase: {self.broadphase}")
+
     def kd_collisions(self):
-        data = [obj.pos_curr for obj in self.verlet_objects]
-        kd = KDTree(data)
-        pairs = kd.query_pairs(r=0.4)
-        for (i, j) in pairs:
-            self.handle_collision(self.verlet_objects[i], self.verlet_objects[j])
+        kd = KDTree(self.store.pos_curr)
+        pairs = kd.query_pairs(r=2 * self.store.radius.max(), output_type='ndarray')
+        self.resolve_collisions(pairs)
+
+    def neighbor_collisions(self):
+        # kd pairs cached in a Verlet neighbor list, rebuilt only once something moved far enough
+        max_radius = self.store.radius.max()
+        skin = self.skin * max_radius
+        if self.neighbors is None:
+            self.neighbors = NeighborList(skin)
+        self.neighbors.set_skin(skin)
+        pairs = self.neighbors.query_pairs(self.store.pos_curr, 2 * max_radius)
+        self.resolve_collisions(pairs)
+
+    def grid_collisions(self):
+        # Cells are one max diameter wide, so every contact lies in the same or an adjacent cell
+        cell_size = 2 * self.store.radius.max()
+        if cell_size <= 0:
+            return
+        c_radius = self.container.scale
+        c_position = np.asarray(self.container.position, dtype=np.float64)
+        lower = c_position - c_radius
+        upper = c_position + c_radius
+        if self.grid is None or not self.grid.fits(lower, upper, cell_size):
+            self.grid = UniformGrid(lower, upper, cell_size, Solver.grid_size)
+        pairs = self.grid.query_pairs(self.store.pos_curr, self.store.radius)
+        self.resolve_collisions(pairs)
+
+    def resolve_collisions(self, pairs):
+        if len(pairs) == 0:
+            return
+        if self.compiled:
+            if self.collision_mode == "jacobi":
+                kernels.jacobi_collisions(self.store.pos_curr, self.store.radius, pairs, Solver.jacobi_iterations,
+                                          Solver.jacobi_relaxation)
+            elif self.collision_mode == "gauss_seidel":
+                kernels.gauss_seidel_collisions(self.store.pos_curr, self.store.radius, pairs)
+            else:
+                raise ValueError(f"Unknown collision mode: {self.collision_mode}")
+        elif self.collision_mode == "jacobi":
+            self.jacobi_collisions(pairs)
+        elif self.collision_mode == "gauss_seidel":
+            self.gauss_seidel_collisions(pairs)
+        else:
+            raise ValueError(f"Unknown collision mode: {self.collision_mode}")
+
+    def jacobi_collisions(self, pairs):
+        # Every pair is resolved against the same positions. A particle's corrections are averaged over
+        # its contacts, summing them would push a ball touching several neighbors too far.
+        pos_curr = self.store.pos_curr
+        radius = self.store.radius
+        n = len(pos_curr)
+        i, j = pairs[:, 0], pairs[:, 1]
+        min_dist = radius[i] + radius[j]
+        for _ in range(Solver.jacobi_iterations):
+            axis = pos_curr[i] - pos_curr[j]
+            dist = row_norms(axis)
+            hit = (dist > 0) & (dist < min_dist)
+            if not hit.any():
+                return
+            a, b = i[hit], j[hit]
+            correction = axis[hit] * (0.5 * (min_dist[hit] - dist[hit]) / dist[hit])[:, None]
+            contacts = np.bincount(a, minlength=n) + np.bincount(b, minlength=n)
+            weight = Solver.jacobi_relaxation / np.maximum(contacts, 1)
+            for k in range(3):
+                pos_curr[:, k] += (np.bincount(a, correction[:, k], minlength=n)
+                                   - np.bincount(b, correction[:, k], minlength=n)) * weight
+
+    def gauss_seidel_collisions(self, pairs):
+        # Pairs are resolved one after another, each seeing the previous corrections
+        pos_curr = self.store.pos_curr
+        radius = self.store.radius
+        for i, j in pairs:
+            axis = pos_curr[i] - pos_curr[j]
+            dist = np.sqrt(axis.dot(axis))
+            min_dist = radius[i] + radius[j]
+            if 0 < dist < min_dist:
+                n = axis / dist
+                delta = min_dist - dist
+                pos_curr[i] += 0.5 * delta * n
+                pos_curr[j] -= 0.5 * delta * n
 
     def apply_constraints(self):
         # Floor
@@ -116,12 +485,17 @@ class Solver:
         # Circle (Convex)
         c_radius = self.container.scale
         c_position = self.container.position
-        for obj in self.verlet_objects:
-            disp = obj.pos_curr - c_position
-            dist = np.sqrt(disp.dot(disp))
-            if dist > c_radius - obj.radius:
-                n = disp / dist
-                obj.pos_curr = c_position + n * (c_radius - obj.radius)
+        if self.compiled:
+            kernels.apply_sphere_constraint(self.store.pos_curr, self.store.radius,
+                                            np.asarray(c_position, dtype=np.float64), float(c_radius))
+            return
+        pos_curr = self.store.pos_curr
+        disp = pos_curr - c_position
+        dist = row_norms(disp)
+        limit = c_radius - self.store.radius
+        outside = dist > limit
+        n = disp[outside] / dist[outside, None]
+        pos_curr[outside] = c_position + n * limit[outside, None]
 
         # Cube
         # for obj in self.verlet_objects:
@@ -138,27 +512,53 @@ class Solver:
         #             obj.pos_old[i] = obj.pos_curr[i] + disp
 
     def update_links(self):
-        for link in self.links:
-            link.apply()
+        if len(self.links) == 0:
+            return
+        if self.compiled:
+            link_a, link_b, target, _ = self.links.batches()
+            kernels.apply_links(self.store.pos_curr, self.store.tag, link_a, link_b, target)
+            return
+        self.links.apply(self.store.pos_curr, self.store.tag)
+
+    def get_link_arrays(self):
+        # Endpoint indices and targets in insertion order
+        return self.links.a, self.links.b, self.links.target
+
+    def clear(self):
+        # Removes every particle and link, handles from before no longer point into the store
+        self.store.count = 0
+        self.verlet_objects = []
+        self.links = LinkStore()
+        self.neighbors = None
 
     def add_object(self, obj):
+        obj.bind(self.store)
         self.verlet_objects.append(obj)
 
+    def add_objects(self, positions, radii=1, tags=0):
+        # Bulk add_object from arrays, returns the new particle indices
+        indices = self.store.add_many(positions, radii, tags)
+        self.verlet_objects.extend(VerletObject.view(self.store, index) for index in indices.tolist())
+        return indices
+
+    def link_neighbors(self, indices, max_distance):
+        # Links every pair of the given particles at most max_distance apart, at their current distance.
+        # Returns the indices of the new links.
+        indices = np.asarray(indices, dtype=np.int64)
+        pairs = KDTree(self.store.pos_curr[indices]).query_pairs(r=max_distance, output_type='ndarray')
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]  # Deterministic link and color order
+        a, b = indices[pairs[:, 0]], indices[pairs[:, 1]]
+        target = row_norms(self.store.pos_curr[a] - self.store.pos_curr[b])
+        return self.links.add_many(a, b, target)
+
     def add_link(self, target, obj_a, obj_b):
-        for link in self.links:
-            if link.b is obj_a and link.a is obj_b:
-                return
-            if link.b is obj_b and link.a is obj_a:
-                return
-        link = Link(obj_a, obj_b, target)
-        self.links.append(link)
+        # Ignored when the two objects are already linked
+        self.links.add(obj_a.index, obj_b.index, target)
 
     def expanding_force(self, center, strength):
-        for obj in self.verlet_objects:
-            disp = obj.pos_curr - center
-            dist = np.sqrt(disp.dot(disp))
-            if dist > 0:
-                n = disp / dist
-                obj.acceleration += n * strength
+        disp = self.store.pos_curr - center
+        dist = row_norms(disp)
+        nonzero = dist > 0
+        self.store.acceleration[nonzero] += disp[nonzero] / dist[nonzero, None] * strength
 
 
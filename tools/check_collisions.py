@@ -0,0 +1,64 @@
+import argparse
+import sys
+
+import numpy as np
+from scipy.spatial import KDTree
+
+from src.simulate import SpawnSchedule
+from src.verlet import Container, Solver, row_norms
+
+
+def overlaps(solver):
+    # Depth of every contact in the store
+    positions = solver.store.pos_curr
+    radius = solver.store.radius
+    pairs = KDTree(positions).query_pairs(2 * radius.max(), output_type='ndarray')
+    i, j = pairs[:, 0], pairs[:, 1]
+    depth = radius[i] + radius[j] - row_norms(positions[i] - positions[j])
+    return depth[depth > 0]
+
+
+def settle(collision_mode, args):
+    # Window's scene: balls dropped into the sphere container. Overlap and per-step motion are
+    # averaged over the last `window` steps, once the pile has settled.
+    solver = Solver(Container(scale=4))
+    solver.skin = 1.0
+    solver.collision_mode = collision_mode
+    schedule = SpawnSchedule(max_balls=args.balls, seed=args.seed)
+    max_overlap, mean_overlap, speed = [], [], []
+    for step in range(args.steps):
+        schedule.step(solver)
+        solver.update()
+        if step >= args.steps - args.window:
+            speed.append(row_norms(solver.store.pos_curr - solver.store.pos_old).mean())
+            if step % 50 == 0:
+                depth = overlaps(solver)
+                max_overlap.append(depth.max(initial=0))
+                mean_overlap.append(depth.mean() if len(depth) else 0)
+    return np.mean(max_overlap), np.mean(mean_overlap), np.mean(speed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the jacobi collision mode settles a pile as tightly "
+                                                 "and as still as gauss_seidel")
+    parser.add_argument("--steps", type=int, default=3000)
+    parser.add_argument("--window", type=int, default=1000, help="settled steps measured at the end")
+    parser.add_argument("--balls", type=int, default=350)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed excess over gauss_seidel, as a fraction of its value")
+    args = parser.parse_args()
+
+    results = {mode: settle(mode, args) for mode in ("gauss_seidel", "jacobi")}
+    for mode, (max_overlap, mean_overlap, speed) in results.items():
+        print(f"{mode:13} max overlap {max_overlap:.4f} mean overlap {mean_overlap:.4f} mean speed {speed:.5f}")
+
+    failures = [name for name, jacobi, gauss_seidel in zip(("max overlap", "mean overlap", "mean speed"),
+                                                          results["jacobi"], results["gauss_seidel"])
+                if jacobi > gauss_seidel * (1 + args.tolerance)]
+    if failures:
+        sys.exit(f"jacobi exceeds gauss_seidel by more than {args.tolerance:.0%} in: {', '.join(failures)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import src.offscreen  # Picks the headless GL platform, has to come before anything imports OpenGL
+
+import argparse
+import sys
+
+from src.offscreen import OffscreenWindow
+from tools.gl_spy import GLSpy, NullSink
+
+DRAW_CALLS = ("glDrawArrays", "glDrawElements", "glDrawArraysInstanced", "glDrawElementsInstanced")
+
+
+# Renders a scene with balls and a cloth headless, alternating between the instanced and the
+# per-object path every frame, and records the draw calls each frame issued
+class DrawCallWindow(OffscreenWindow):
+
+    def __init__(self, frames, cloth_size):
+        self.results = []  # (instanced, balls, links, draw calls)
+        super().__init__(frames, NullSink(), width=320, height=240, seed=0, cloth_size=cloth_size)
+
+    def render_frame(self):
+        self.instanced = len(self.results) % 2 == 0
+        with GLSpy(DRAW_CALLS) as spy:
+            super().render_frame()
+        self.results.append((self.instanced, self.solver.store.count, len(self.solver.links),
+                             sum(spy.calls.values())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that instanced rendering issues one draw call per "
+                                                 "mesh, whatever the number of balls and links")
+    parser.add_argument("--frames", type=int, default=40)
+    parser.add_argument("--cloth", type=int, default=8)
+    args = parser.parse_args()
+
+    window = DrawCallWindow(args.frames, args.cloth)
+    failures = 0
+    for frame, (instanced, balls, links, draws) in enumerate(window.results):
+        # The container is one draw in both paths, balls and links one each or one per object
+        expected = 3 if instanced else 1 + balls + links
+        if draws != expected:
+            print(f"frame {frame}: {draws} draw calls, expected {expected}", file=sys.stderr)
+            failures += 1
+
+    instanced = [draws for is_instanced, _, _, draws in window.results if is_instanced]
+    single = [draws for is_instanced, _, _, draws in window.results if not is_instanced]
+    _, balls, links, _ = window.results[-1]
+    print(f"{balls} balls, {links} links: {max(instanced)} draw calls per instanced frame, "
+          f"up to {max(single)} per frame without instancing")
+    if failures:
+        sys.exit(f"{failures} of {len(window.results)} frames issued an unexpected number of draw calls")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import src.offscreen  # Picks the headless GL platform, has to come before anything imports OpenGL
+
+import argparse
+import sys
+
+import numpy as np
+from OpenGL.GL import *
+
+from src.offscreen import OffscreenWindow
+from tools.gl_spy import NullSink
+
+NEAR, FAR = 0.1, 100  # Window.setup_shader's projection
+
+
+def view_depth(depth):
+    # Distance along the view axis of depth buffer values in [0, 1], for depth values < 1
+    ndc = 2 * depth.astype(np.float64) - 1
+    return 2 * NEAR * FAR / (FAR + NEAR - ndc * (FAR - NEAR))
+
+
+def erode(mask, pixels):
+    # Pixels of mask whose whole (2 * pixels + 1)^2 neighborhood is in mask too
+    height, width = mask.shape
+    padded = np.pad(mask, pixels)
+    out = mask.copy()
+    for dy in range(2 * pixels + 1):
+        for dx in range(2 * pixels + 1):
+            out &= padded[dy:dy + height, dx:dx + width]
+    return out
+
+
+# Draws the same resting balls as instanced meshes and as impostors in one context and reads back
+# color and depth of both frames
+class DepthWindow(OffscreenWindow):
+
+    def __init__(self, width, height, radius):
+        self.radius = radius
+        self.passes = {}
+        super().__init__(1, NullSink(), width=width, height=height, seed=0)
+
+    def run(self):
+        self.timestep.schedule = None
+        # The camera orbits from +x looking towards -x. Balls on a 4 x 4 grid across the view, at
+        # different distances but apart enough on screen not to hide each other. Nothing is stepped.
+        self.global_time = 0
+        self.orbit_camera()
+        y, z = np.meshgrid(np.linspace(-1.5, 2.5, 4), np.linspace(-2.4, 2.4, 4), indexing="ij")
+        x = np.linspace(-2, 2, y.size).reshape(y.shape)
+        self.solver.add_objects(np.stack([x, y, z], axis=-1).reshape(-1, 3), self.radius)
+        self.dt = 0
+        self.instanced = True
+        for impostors in (False, True):
+            self.impostors = impostors
+            self.render_frame()
+            self.passes[impostors] = self.read()
+        self.quit()
+
+    def read(self):
+        glFinish()
+        color = glReadPixels(0, 0, self.WIDTH, self.HEIGHT, GL_RGBA, GL_UNSIGNED_BYTE)
+        depth = glReadPixels(0, 0, self.WIDTH, self.HEIGHT, GL_DEPTH_COMPONENT, GL_FLOAT)
+        color = np.frombuffer(color, dtype=np.uint8).reshape(self.HEIGHT, self.WIDTH, 4)
+        depth = np.frombuffer(depth, dtype=np.float32).reshape(self.HEIGHT, self.WIDTH)
+        return color, depth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the depth written by impostor spheres with the "
+                                                 "sphere mesh's")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--radius", type=float, default=0.4)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="largest depth difference allowed, in ball radii (the sphere mesh's facets sag "
+                             "up to about 0.2 radii)")
+    args = parser.parse_args()
+
+    window = DepthWindow(args.width, args.height, args.radius)
+    mesh_color, mesh_depth = window.passes[False]
+    impostor_color, impostor_depth = window.passes[True]
+    # Edges are left out: the mesh's facets lie inside the sphere, so along the silhouette the
+    # mesh misses pixels the impostor covers and whatever is behind shows through. Erosion also
+    # drops the container's points.
+    mesh_covered = erode(mesh_depth < 1, 2)
+    impostor_covered = erode(impostor_depth < 1, 2)
+    both = mesh_covered & impostor_covered
+    # Positive where the mesh is behind the true sphere surface, by at most the facets' sag
+    difference = (view_depth(mesh_depth[both]) - view_depth(impostor_depth[both])) / args.radius
+    color_difference = np.abs(mesh_color[both, :3].astype(np.int16) - impostor_color[both, :3]).mean()
+    print(f"interior pixels: mesh {mesh_covered.sum()}, impostors {impostor_covered.sum()}, both {both.sum()}")
+    print(f"mesh - impostor depth in radii: mean {difference.mean():.4f}, min {difference.min():.4f}, "
+          f"max {difference.max():.4f}")
+    print(f"mean color difference {color_difference:.2f} of 255")
+
+    failures = []
+    if not both.any():
+        failures.append("no ball covers any pixel in both frames")
+    else:
+        if (mesh_covered & ~(impostor_depth < 1)).any():
+            failures.append("impostors leave pixels of the mesh spheres uncovered")
+        if mesh_covered.sum() < 0.85 * impostor_covered.sum():
+            failures.append("impostors cover far more pixels than the mesh spheres")
+        if difference.min() < -args.tolerance / 25:
+            failures.append("impostor depth is behind the mesh surface")
+        if difference.max() > args.tolerance or difference.mean() > args.tolerance / 2.5:
+            failures.append(f"impostor depth is off the mesh surface by more than {args.tolerance} radii")
+        if color_difference > 8:
+            failures.append("impostor shading differs from the mesh spheres")
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(f"{len(failures)} impostor checks failed")
+
+
+if __name__ == '__main__':
+    main()
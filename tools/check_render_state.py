@@ -0,0 +1,104 @@
+import src.offscreen  # Picks the headless GL platform, has to come before anything imports OpenGL
+
+import argparse
+import sys
+
+from OpenGL.GL import GL_BLEND, GL_DEPTH_TEST, GL_TEXTURE_2D
+
+from src.offscreen import OffscreenWindow
+from src.render_state import RenderState, render_state
+from tools.gl_spy import GLSpy, NullSink
+
+STATE_CALLS = ("glUseProgram", "glBindVertexArray", "glActiveTexture", "glBindTexture", "glEnable", "glDisable")
+
+
+def check_mocked():
+    # A fixed sequence of binds against fake GL functions, with the calls each one should cost
+    state = RenderState()
+    with GLSpy(STATE_CALLS, fake=True) as spy:
+        for program in (1, 1, 1, 2, 1):
+            state.use_program(program)
+        state.bind_vertex_array(5)
+        state.bind_vertex_array(5)
+        state.bind_texture(0, GL_TEXTURE_2D, 7)
+        state.bind_texture(0, GL_TEXTURE_2D, 7)
+        state.bind_texture(1, GL_TEXTURE_2D, 8)
+        state.enable(GL_DEPTH_TEST)
+        state.enable(GL_DEPTH_TEST)
+        state.disable(GL_BLEND)
+        state.disable(GL_BLEND)
+        state.invalidate()
+        state.use_program(1)
+    expected = {
+        "glUseProgram": {"issued": 4, "skipped": 2},
+        "glBindVertexArray": {"issued": 1, "skipped": 1},
+        "glBindTexture": {"issued": 2, "skipped": 1},
+        "glActiveTexture": {"issued": 2, "skipped": 0},
+        "glEnable": {"issued": 1, "skipped": 1},
+        "glDisable": {"issued": 1, "skipped": 1},
+    }
+    failures = []
+    if state.stats() != expected:
+        failures.append(f"mocked: stats {state.stats()}, expected {expected}")
+    for name in STATE_CALLS:
+        issued = expected[name]["issued"]
+        if spy.calls[name] != issued:
+            failures.append(f"mocked: {spy.calls[name]} {name} calls reached GL, expected {issued}")
+    return failures
+
+
+# Renders headless and counts the state calls that actually reach GL after the first frame, the
+# ones render_state reports as issued have to match them exactly
+class RenderStateWindow(OffscreenWindow):
+
+    def __init__(self, frames, cloth_size):
+        self.rendered = 0
+        self.spy = GLSpy(STATE_CALLS)
+        super().__init__(frames, NullSink(), width=320, height=240, seed=0, cloth_size=cloth_size)
+
+    def render_frame(self):
+        if self.rendered == 1:
+            render_state.reset_stats()
+            self.spy.take()
+        with self.spy:
+            super().render_frame()
+        self.rendered += 1
+
+
+def check_frames(frames, cloth_size):
+    window = RenderStateWindow(frames, cloth_size)
+    stats = render_state.stats()
+    calls = window.spy.calls
+    failures = []
+    for name in STATE_CALLS:
+        issued = stats.get(name, {}).get("issued", 0)
+        if calls[name] != issued:
+            failures.append(f"frames: {calls[name]} {name} calls reached GL, render_state issued {issued}")
+
+    issued = sum(counts["issued"] for counts in stats.values())
+    skipped = sum(counts["skipped"] for counts in stats.values())
+    for name, counts in stats.items():
+        print(f"{name:18} issued {counts['issued']:6} skipped {counts['skipped']:6}")
+    print(f"{frames - 1} frames: {issued} state changes issued, {skipped} skipped "
+          f"({skipped / max(issued + skipped, 1):.0%} of requests)")
+    if skipped == 0:
+        failures.append("frames: render_state skipped no redundant state change")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that render_state skips redundant binds and that "
+                                                 "its issued counters match the GL calls made")
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--cloth", type=int, default=8)
+    args = parser.parse_args()
+
+    failures = check_mocked() + check_frames(args.frames, args.cloth)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(f"{len(failures)} render_state checks failed")
+
+
+if __name__ == '__main__':
+    main()
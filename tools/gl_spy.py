@@ -0,0 +1,51 @@
+import sys
+from collections import Counter
+
+
+# Counts calls to GL functions as the src modules see them. `from OpenGL.GL import *` copies every
+# function into the importing module, so it is those copies that get wrapped, not OpenGL.GL's.
+# With fake=True calls are only counted and never reach GL, no context needed.
+class GLSpy:
+
+    def __init__(self, names, fake=False):
+        self.names = names
+        self.fake = fake
+        self.calls = Counter()
+        self.patched = []
+
+    def __enter__(self):
+        modules = [module for name, module in list(sys.modules.items()) if name.split(".")[0] == "src"]
+        for module in modules:
+            for name in self.names:
+                function = getattr(module, name, None)
+                if function is not None:
+                    self.patched.append((module, name, function))
+                    setattr(module, name, self.wrap(name, function))
+        return self
+
+    def wrap(self, name, function):
+        def call(*args, **kwargs):
+            self.calls[name] += 1
+            if not self.fake:
+                return function(*args, **kwargs)
+        return call
+
+    def __exit__(self, *exc):
+        for module, name, function in reversed(self.patched):
+            setattr(module, name, function)
+        self.patched.clear()
+
+    def take(self):
+        # Calls counted since the last take()
+        calls = self.calls
+        self.calls = Counter()
+        return calls
+
+
+class NullSink:
+
+    def write(self, frame):
+        pass
+
+    def close(self):
+        pass